@@ -0,0 +1,111 @@
+# Velocity-adaptive polling schedule for 4chan boards
+
+import heapq
+import time
+
+
+class BoardScheduler:
+    """
+    Decides when each board is polled next. Every poll feeds the board's catalog
+    back in; the scheduler estimates post velocity and thread turnover from the
+    difference with the previous catalog and picks an interval between
+    `min_interval` and `max_interval`:
+
+    - post velocity: poll roughly every `target_new_posts` new posts
+    - thread turnover: poll before a full catalog page has been pruned, so threads
+      on the last page are seen at least once before they fall off
+
+    Intervals are then stretched together so the estimated request rate of all
+    boards stays within `request_budget` requests per second. Boards wait in a
+    priority queue keyed on their next due time.
+    """
+
+    def __init__(self, boards, initial_interval=120, min_interval=30, max_interval=900,
+                 request_budget=1.0, target_new_posts=50, smoothing=0.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.request_budget = request_budget
+        self.target_new_posts = target_new_posts
+        self.smoothing = smoothing
+
+        now = time.monotonic()
+        self.boards = {}
+        self.queue = []
+        for board in dict.fromkeys(boards):
+            self.boards[board] = {
+                "interval": initial_interval,
+                "velocity": None,  # new posts per second
+                "turnover": None,  # pruned threads per second
+                "cost": 1.0,  # requests per poll
+                "catalog": None,  # {thread_number: replies} from the previous poll
+                "page_size": None,
+                "polled_at": None,
+            }
+            heapq.heappush(self.queue, (now, board))
+
+    def next_board(self):
+        """Block until the next board is due and return it"""
+        due, board = heapq.heappop(self.queue)
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return board
+
+    def reschedule(self, board, delay):
+        """Put a board back in the queue after `delay` seconds without updating its estimates"""
+        heapq.heappush(self.queue, (time.monotonic() + delay, board))
+
+    def record_poll(self, board, catalog, requests_made):
+        """Update a board's estimates from a fresh catalog, schedule its next poll and return the interval"""
+        stats = self.boards[board]
+        now = time.monotonic()
+        current = {
+            thread_preview["no"]: thread_preview.get("replies", 0)
+            for page in catalog
+            for thread_preview in page["threads"]
+        }
+
+        previous = stats["catalog"]
+        if previous is not None and now > stats["polled_at"]:
+            elapsed = now - stats["polled_at"]
+            new_posts = 0
+            for thread_number, replies in current.items():
+                if thread_number in previous:
+                    new_posts += max(0, replies - previous[thread_number])
+                else:
+                    new_posts += replies + 1
+            pruned = sum(1 for thread_number in previous if thread_number not in current)
+            stats["velocity"] = self.smooth(stats["velocity"], new_posts / elapsed)
+            stats["turnover"] = self.smooth(stats["turnover"], pruned / elapsed)
+
+        stats["catalog"] = current
+        stats["page_size"] = max((len(page["threads"]) for page in catalog), default=None)
+        stats["polled_at"] = now
+        stats["cost"] = self.smooth(stats["cost"], requests_made)
+        stats["interval"] = self.board_interval(stats)
+
+        interval = min(self.max_interval, stats["interval"] * self.budget_scale())
+        heapq.heappush(self.queue, (now + interval, board))
+        return interval
+
+    def board_interval(self, stats):
+        """Interval a board would get on its own, ignoring the shared request budget"""
+        if stats["velocity"] is None and stats["turnover"] is None:
+            # nothing to estimate from until a second catalog has been seen
+            return stats["interval"]
+        candidates = [self.max_interval]
+        if stats["velocity"]:
+            candidates.append(self.target_new_posts / stats["velocity"])
+        if stats["turnover"] and stats["page_size"]:
+            candidates.append(stats["page_size"] / stats["turnover"])
+        return max(self.min_interval, min(candidates))
+
+    def budget_scale(self):
+        """Factor to stretch every interval by so all boards together fit in the request budget"""
+        demand = sum(stats["cost"] / stats["interval"] for stats in self.boards.values())
+        return max(1.0, demand / self.request_budget)
+
+    def smooth(self, previous, sample):
+        if previous is None:
+            return sample
+        return self.smoothing * sample + (1 - self.smoothing) * previous
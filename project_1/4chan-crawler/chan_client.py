@@ -1,7 +1,12 @@
 # 4chan api client that has minimal functionality to collect data
 
+import asyncio
 import logging
-import requests
+import threading
+import time
+from collections import OrderedDict
+from requests.exceptions import RequestException
+from http_session import get_session
 
 # logger setup
 logger = logging.getLogger("4chan client")
@@ -15,18 +20,101 @@ logger.addHandler(sh)
 # API_BASE = "http://a.4cdn.org"
 
 
+class TokenBucket:
+    """
+    Token bucket limiting requests to `rate` per second with bursts of `capacity`.
+    Callers reserve a token and are told how long to wait for it, so the budget
+    is shared between threads and event loops without holding a lock while waiting
+    """
+
+    def __init__(self, rate=1.0, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            # A negative balance is a queue of callers that already hold a later slot
+            return max(0.0, -self.tokens / self.rate)
+
+    def wait(self):
+        time.sleep(self.reserve())
+
+    async def acquire(self):
+        await asyncio.sleep(self.reserve())
+
+
 class ChanClient:
     API_BASE = "http://a.4cdn.org"
-    # def __init__(self):
+
+    def __init__(self, cache_size=256, rate=1.0, burst=1, session=None):
+        # Keep-alive session; pass one in to share a pool or to stub http in tests
+        self._session = session
+        # api_call -> (last_modified, etag, json), least recently used first
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
+        # api_calls whose last response was a 404, as opposed to a transient failure,
+        # oldest first; bounded because only dead threads' entries are ever read
+        self.not_found = OrderedDict()
+        self.not_found_size = 4096
+        # One bucket for every request this client makes, sync or async
+        self.rate_limiter = TokenBucket(rate, burst)
+
+    """
+    The injected session, or the process-wide shared one (rebuilt after a fork)
+    """
+
+    @property
+    def session(self):
+        return self._session or get_session()
+
+    """
+    This executes an http request and returns json, revalidating cached
+    responses with If-Modified-Since so unchanged resources are not re-downloaded
+    """
+
     def execute_request(self, api_call):
+        with self.cache_lock:
+            cached = self.cache.get(api_call)
+        headers = {}
+        if cached:
+            last_modified, etag, _ = cached
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+            if etag:
+                headers["If-None-Match"] = etag
+
         try:
-            resp = requests.get(api_call)
+            resp = self.session.get(api_call, headers=headers)
+            if resp.status_code == 304 and cached:
+                with self.cache_lock:
+                    if api_call in self.cache:
+                        self.cache.move_to_end(api_call)
+                return cached[2]
             if resp.status_code != 200:
                 logger.info(f"Received status code {resp.status_code} for API call: {api_call}")
+                if resp.status_code == 404:
+                    with self.cache_lock:
+                        self.cache.pop(api_call, None)
+                        self.not_found[api_call] = None
+                        self.not_found.move_to_end(api_call)
+                        while len(self.not_found) > self.not_found_size:
+                            self.not_found.popitem(last=False)
                 return None  # Skip further processing if the response is not 200 OK
-            
+
             # Try parsing the JSON only if the response is valid
-            return resp.json()
+            json = resp.json()
+            with self.cache_lock:
+                self.not_found.pop(api_call, None)
+            self.cache_response(api_call, resp, json)
+            return json
         except RequestException as e:
             logger.error(f"Request to {api_call} failed: {e}")
             return None
@@ -34,6 +122,21 @@ class ChanClient:
             logger.error(f"Failed to decode JSON from response for API call: {api_call}")
             return None
 
+    """
+    Remember validators and parsed json for a response, evicting the least recently used entry
+    """
+
+    def cache_response(self, api_call, resp, json):
+        last_modified = resp.headers.get("Last-Modified")
+        etag = resp.headers.get("ETag")
+        if not last_modified and not etag:
+            return
+        with self.cache_lock:
+            self.cache[api_call] = (last_modified, etag, json)
+            self.cache.move_to_end(api_call)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
     # need to be able to collect threads
     """
     Get json for a given thread
@@ -42,39 +145,69 @@ class ChanClient:
     def get_thread(self, board, thread_number):
         # sample api call: http://a.4cdn.org/pol/thread/124205675.json
         # make an http request to the url
-        request_pieces = [board, "thread", f"{thread_number}.json"]
-
-        api_call = self.build_request(request_pieces)
+        api_call = self.thread_request(board, thread_number)
+        self.rate_limiter.wait()
         return self.execute_request(api_call)
 
+    """
+    Whether the last fetch of a thread failed with a 404; the answer is only given once
+    """
+
+    def thread_not_found(self, board, thread_number):
+        api_call = self.thread_request(board, thread_number)
+        with self.cache_lock:
+            if api_call in self.not_found:
+                del self.not_found[api_call]
+                return True
+            return False
+
     """
     Get catalog json for a given board
     """
 
     def get_catalog(self, board):
-        request_pieces = [board, "catalog.json"]
-        api_call = self.build_request(request_pieces)
+        api_call = self.catalog_request(board)
+        self.rate_limiter.wait()
+        return self.execute_request(api_call)
 
+    """
+    Get the numbers of a board's archived threads
+    """
+
+    def get_archive(self, board):
+        api_call = self.build_request([board, "archive.json"])
+        self.rate_limiter.wait()
         return self.execute_request(api_call)
 
     """
-    Build a request from pieces
+    Async versions of get_thread/get_catalog: wait for a token without blocking
+    the event loop and run the http request on the default executor
     """
 
-    def build_request(self, request_pieces):
-        api_call = "/".join([self.API_BASE] + request_pieces)
-        return api_call
+    async def get_thread_async(self, board, thread_number):
+        return await self.execute_request_async(self.thread_request(board, thread_number))
+
+    async def get_catalog_async(self, board):
+        return await self.execute_request_async(self.catalog_request(board))
+
+    async def execute_request_async(self, api_call):
+        await self.rate_limiter.acquire()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.execute_request, api_call)
+
+    def thread_request(self, board, thread_number):
+        return self.build_request([board, "thread", f"{thread_number}.json"])
+
+    def catalog_request(self, board):
+        return self.build_request([board, "catalog.json"])
 
     """
-    This executes an http request and returns json
+    Build a request from pieces
     """
 
-    def execute_request(self, api_call):
-        resp = requests.get(api_call)  # error handling neede
-        logger.info(resp.status_code)
-        json = resp.json()  # error handling neede
-        logger.info(f"json: {json}")
-        return json
+    def build_request(self, request_pieces):
+        api_call = "/".join([self.API_BASE] + request_pieces)
+        return api_call
 
 
 if __name__ == "__main__":
@@ -1,235 +1,14 @@
-# from chan_client import ChanClient
-# import logging
-# from pyfaktory import Client, Consumer, Job, Producer
-# import datetime
-# import psycopg2
-# import time
-# from psycopg2 import pool
-# from psycopg2.extras import Json
-# from psycopg2.extensions import register_adapter
-# from retry import retry
-# import os
-# import uuid
-# from dotenv import load_dotenv
-
-# # Register adapter to allow psycopg2 to insert a dict into a JSONB column
-# register_adapter(dict, Json)
-
-# # Initialize logger
-# logger = logging.getLogger("4chan client")
-# logger.propagate = False
-# logger.setLevel(logging.INFO)
-# sh = logging.StreamHandler()
-# formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-# sh.setFormatter(formatter)
-# logger.addHandler(sh)
-
-# # Load environment variables
-# load_dotenv()
-# FAKTORY_SERVER_URL = os.environ.get("FAKTORY_SERVER_URL")
-# DATABASE_URL = os.environ.get("DATABASE_URL")
-
-# # Initialize a database connection pool
-# try:
-#     db_pool = psycopg2.pool.SimpleConnectionPool(1, 20, dsn=DATABASE_URL)
-#     if db_pool:
-#         logger.info("Connection pool created successfully")
-# except Exception as e:
-#     logger.error(f"Error creating connection pool: {e}")
-
-# # Generate a unique worker ID for this instance
-# worker_id = f"worker-{uuid.uuid4()}"
-# logger.info(f"Starting worker with ID: {worker_id}")
-
-# def thread_numbers_from_catalog(catalog):
-#     thread_numbers = []
-#     for page in catalog:
-#         for thread in page["threads"]:
-#             thread_number = thread["no"]
-#             thread_numbers.append(thread_number)
-#     return thread_numbers
-
-# def find_dead_threads(previous_catalog_thread_numbers, current_catalog_thread_numbers):
-#     dead_thread_numbers = set(previous_catalog_thread_numbers).difference(set(current_catalog_thread_numbers))
-#     return dead_thread_numbers
-
-# @retry(tries=3, delay=2, backoff=2)
-# def fetch_thread(board, thread_number):
-#     chan_client = ChanClient()
-#     thread_data = chan_client.get_thread(board, thread_number)
-#     if not thread_data:
-#         raise Exception(f"Failed to fetch data for thread {thread_number}")
-#     return thread_data
-# def crawl_thread(board, thread_number):
-#     logger.info(f"Starting to crawl thread {thread_number} on board {board}")
-#     try:
-#         thread_data = fetch_thread(board, thread_number)
-#         logger.info(f"Thread fetched: {board}/{thread_number}")
-
-#         conn = db_pool.getconn()
-#         cur = conn.cursor()
-
-#         for post in thread_data["posts"]:
-#             post_number = post["no"]
-#             country = post.get("country", "")
-#             country_name = post.get("country_name", "")
-#             is_op = post.get("resto") == 0  # Check if it's the original post
-
-#             # Insert into posts table
-#             post_query = """
-#             INSERT INTO chan_posts (board, thread_number, post_number, data, country, country_name) 
-#             VALUES (%s, %s, %s, %s, %s, %s) 
-#             ON CONFLICT (post_number) DO NOTHING RETURNING id
-#             """
-#             cur.execute(post_query, (board, thread_number, post_number, Json(post), country, country_name))
-#             conn.commit()
-
-#             result = cur.fetchone()
-#             if result:
-#                 db_id = result[0]
-#                 logger.info(f"Inserted DB id: {db_id}")
-
-#                 # Insert into submissions or comments based on post type
-#                 if is_op:
-#                     submission_query = """
-#                     INSERT INTO chan_submissions (post_id, submission_number, data)
-#                     VALUES (%s, %s, %s)
-#                     """
-#                     cur.execute(submission_query, (post_number, post_number, Json(post)))
-#                 else:
-#                     comment_query = """
-#                     INSERT INTO chan_comments (post_id, comment_number, data)
-#                     VALUES (%s, %s, %s)
-#                     """
-#                     cur.execute(comment_query, (post["resto"], post_number, Json(post)))
-
-#                 conn.commit()
-#             else:
-#                 logger.info(f"Post {post_number} already exists in the database.")
-
-#     except psycopg2.Error as e:
-#         logger.error(f"Database error: {e}")
-#     except Exception as e:
-#         logger.error(f"Error crawling thread {thread_number} on board {board}: {e}")
-#     finally:
-#         if cur:
-#             cur.close()
-#         if conn:
-#             db_pool.putconn(conn)
-
-# # def crawl_thread(board, thread_number):
-# #     logger.info(f"Starting to crawl thread {thread_number} on board {board}")
-# #     try:
-# #         thread_data = fetch_thread(board, thread_number)
-# #         logger.info(f"Thread fetched: {board}/{thread_number}")
-
-# #         conn = db_pool.getconn()
-# #         cur = conn.cursor()
-
-# #         for post in thread_data["posts"]:
-# #             post_number = post["no"]
-# #             country = post.get("country", "")
-# #             country_name = post.get("country_name", "")
-# #             q = """
-# #             INSERT INTO posts (board, thread_number, post_number, data, country, country_name) 
-# #             VALUES (%s, %s, %s, %s, %s, %s) 
-# #             ON CONFLICT (post_number) DO NOTHING RETURNING id
-# #             """
-# #             cur.execute(q, (board, thread_number, post_number, Json(post), country, country_name))
-# #             conn.commit()
-
-# #             result = cur.fetchone()
-# #             if result:
-# #                 db_id = result[0]
-# #                 logger.info(f"Inserted DB id: {db_id}")
-# #             else:
-# #                 logger.info(f"Post {post_number} already exists in the database.")
-
-# #     except psycopg2.Error as e:
-# #         logger.error(f"Database error: {e}")
-# #     except Exception as e:
-# #         logger.error(f"Error crawling thread {thread_number} on board {board}: {e}")
-# #     finally:
-# #         if cur:
-# #             cur.close()
-# #         if conn:
-# #             db_pool.putconn(conn)
-
-# @retry(tries=3, delay=2, backoff=2)
-# def crawl_catalog(board, previous_catalog_thread_numbers=[]):
-#     logger.info(f"Starting catalog crawl for board: {board}")
-#     try:
-#         chan_client = ChanClient()
-#         current_catalog = chan_client.get_catalog(board)
-#         if not current_catalog:
-#             raise Exception(f"Failed to fetch catalog for board {board}")
-
-#         current_catalog_thread_numbers = thread_numbers_from_catalog(current_catalog)
-#         dead_threads = find_dead_threads(previous_catalog_thread_numbers, current_catalog_thread_numbers)
-#         logger.info(f"Dead threads: {dead_threads}")
-
-#         crawl_thread_jobs = []
-#         with Client(faktory_url=FAKTORY_SERVER_URL, role="producer") as client:
-#             producer = Producer(client=client)
-#             for dead_thread in dead_threads:
-#                 job = Job(jobtype="crawl-thread", args=(board, dead_thread), queue="crawl-thread")
-#                 crawl_thread_jobs.append(job)
-#             if crawl_thread_jobs:
-#                 logger.info(f"Enqueuing {len(crawl_thread_jobs)} jobs for board: {board}")
-#                 producer.push_bulk(crawl_thread_jobs)
-
-#         # Schedule another catalog crawl in 5 minutes
-#         with Client(faktory_url=FAKTORY_SERVER_URL, role="producer") as client:
-#             producer = Producer(client=client)
-#             run_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=5)
-#             job = Job(
-#                 jobtype="crawl-catalog",
-#                 args=(board, current_catalog_thread_numbers),
-#                 queue="crawl-catalog",
-#                 at=run_at.isoformat()[:-7] + "Z",
-#             )
-#             logger.info(f"Scheduled next catalog crawl for board: {board} at {run_at}")
-#             producer.push(job)
-#     except Exception as e:
-#         logger.error(f"Error in crawl_catalog for board {board}: {e}")
-
-# def get_boards_from_file(file_path="boards.txt"):
-#     try:
-#         with open(file_path, 'r') as file:
-#             boards = [line.strip() for line in file if line.strip()]
-#         logger.info(f"Loaded boards from file: {boards}")
-#         return boards
-#     except FileNotFoundError:
-#         logger.error(f"File {file_path} not found. Using default boards.")
-#         return ["pol", "sci", "news"]
-
-# if __name__ == "__main__":
-#     boards = get_boards_from_file()
-#     with Client(faktory_url=FAKTORY_SERVER_URL, role="consumer") as client:
-#         consumer = Consumer(
-#             client=client, queues=["crawl-catalog", "crawl-thread"], concurrency=5
-#         )
-#         consumer.register("crawl-catalog", crawl_catalog)
-#         consumer.register("crawl-thread", crawl_thread)
-
-#         try:
-#             for board in boards:
-#                 logger.info(f"Crawling board: {board}")
-#                 crawl_catalog(board)
-
-#             consumer.run()
-
-#         except Exception as e:
-#             logger.error(f"An error occurred: {e}")
-#             time.sleep(30)  # Sleep for 1 minute before retrying if an error occurs
-
-
-
-
 from chan_client import ChanClient
+from board_scheduler import BoardScheduler
+from chan_pipeline import Pipeline
+from spool import Spool
+import argparse
+import asyncio
+import functools
 import logging
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2 import pool
+from psycopg2.extras import Json, execute_values
 import os
 import time
 from datetime import datetime, timezone
@@ -238,6 +17,9 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 DATABASE_URL = os.environ.get("DATABASE_URL")
+# When set, fetched threads are appended to a local spool for chan_spool_loader.py
+# instead of being written to Postgres
+SPOOL_DIR = os.environ.get("SPOOL_DIR")
 
 # Logger setup
 logger = logging.getLogger("4chan crawler")
@@ -248,235 +30,771 @@ formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(messag
 sh.setFormatter(formatter)
 logger.addHandler(sh)
 
+# Spool, opened on first use in each process like the connection pool
+spool = None
+spool_pid = None
+
+# Connection pool, created on first use in each process so forked Faktory workers
+# never share sockets; threaded because thread writes run on the event loop's executor
+connection_pool = None
+connection_pool_pid = None
+
 # Initialize client
 chan_client = ChanClient()
 
-def print_db_stats():
-    """Print detailed database statistics"""
-    conn = psycopg2.connect(dsn=DATABASE_URL)
+# Crawl modes: "full" stores every new or changed thread, "dead" stores threads once
+# as they leave the catalog, "both" does both
+CRAWL_MODES = ("full", "dead", "both")
+
+# Dead threads that 404 but are listed in archive.json are retried this many polls
+MAX_DEAD_ATTEMPTS = 3
+
+# Per-board catalog state, mirrored in chan_catalog_state:
+# board -> {thread_number: {"state": (last_modified, replies, images), "page": page number,
+#                           "captured": stored at this state, "dead_attempts": None while live}}
+board_state = {}
+
+def get_connection_from_pool():
+    """Fetch a connection from the pool."""
+    global connection_pool, connection_pool_pid
+    try:
+        if connection_pool is None or connection_pool_pid != os.getpid():
+            connection_pool = psycopg2.pool.ThreadedConnectionPool(1, 10, dsn=DATABASE_URL)
+            connection_pool_pid = os.getpid()
+        return connection_pool.getconn()
+    except Exception as e:
+        logger.error(f"Error getting connection from pool: {e}")
+        raise
+
+
+def release_connection(conn, close=False):
+    """Release a connection back to the pool, discarding it if it is broken."""
+    if conn:
+        connection_pool.putconn(conn, close=close)
+
+
+def get_spool():
+    """Return this process's spool, or None when not spooling"""
+    global spool, spool_pid
+    if not SPOOL_DIR:
+        return None
+    if spool is None or spool_pid != os.getpid():
+        spool = Spool(SPOOL_DIR, "chan")
+        spool_pid = os.getpid()
+    return spool
+
+
+def spool_thread(board, thread_data):
+    """Append a fetched thread to the spool; returns False if it has no posts"""
+    if not thread_data or not thread_data.get("posts"):
+        return False
+    get_spool().append({"board": board, "fetched_at": time.time(), "thread": thread_data})
+    return True
+
+
+def ensure_schema():
+    """
+    Create the indexes and state tables the crawler relies on. chan_board_stats is
+    filled from the existing rows when it is first created, so its counts cover the
+    data crawled before it.
+    """
+    conn = get_connection_from_pool()
     cur = conn.cursor()
-    
+
     try:
-        # Get posts statistics
+        cur.execute("SELECT to_regclass('chan_board_stats') IS NULL")
+        new_board_stats = cur.fetchone()[0]
         cur.execute("""
-            SELECT 
-                board,
-                COUNT(*) as post_count,
-                MIN(created_at) as earliest_post,
-                MAX(created_at) as latest_post
-            FROM chan_posts
-            GROUP BY board
+            CREATE UNIQUE INDEX IF NOT EXISTS chan_comments_post_id_comment_number_key
+            ON chan_comments (post_id, comment_number)
         """)
-        post_stats = cur.fetchall()
-        
-        # Get comments statistics
         cur.execute("""
-            SELECT 
-    p.board,
-    COUNT(c.id) AS comment_count,
-    MIN(p.created_at) AS earliest_comment,
-    MAX(p.created_at) AS latest_comment
-FROM chan_comments c
-JOIN chan_posts p ON c.post_id = p.id
-GROUP BY p.board
+            CREATE TABLE IF NOT EXISTS chan_catalog_state (
+                board TEXT NOT NULL,
+                thread_number BIGINT NOT NULL,
+                last_modified BIGINT,
+                replies INTEGER NOT NULL DEFAULT 0,
+                images INTEGER NOT NULL DEFAULT 0,
+                page INTEGER,
+                captured BOOLEAN NOT NULL DEFAULT FALSE,
+                dead_attempts INTEGER,
+                PRIMARY KEY (board, thread_number)
+            )
+        """)
+        # Next run of each board's Faktory crawl-catalog chain (see chan_worker.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS chan_catalog_chain (
+                board TEXT PRIMARY KEY,
+                scheduled_at TIMESTAMPTZ NOT NULL
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS chan_board_stats (
+                board TEXT PRIMARY KEY,
+                post_count BIGINT NOT NULL DEFAULT 0,
+                comment_count BIGINT NOT NULL DEFAULT 0,
+                earliest_post TIMESTAMPTZ,
+                latest_post TIMESTAMPTZ,
+                earliest_comment TIMESTAMPTZ,
+                latest_comment TIMESTAMPTZ
+            )
+        """)
+        conn.commit()
+    finally:
+        cur.close()
+        release_connection(conn)
 
+    if new_board_stats:
+        reconcile_board_stats()
+
+
+def print_db_stats():
+    """Print per-board statistics from the incrementally maintained chan_board_stats table"""
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("""
+            SELECT board, post_count, earliest_post, latest_post,
+                   comment_count, earliest_comment, latest_comment
+            FROM chan_board_stats
+            ORDER BY board
         """)
-        comment_stats = cur.fetchall()
+        board_stats = cur.fetchall()
+        conn.commit()
         
         logger.info("=== Database Statistics ===")
-        for board, count, earliest, latest in post_stats:
+        for board, posts, earliest_post, latest_post, comments, earliest_comment, latest_comment in board_stats:
             logger.info(f"/{board}/:")
-            logger.info(f"  Posts: {count} ({earliest} to {latest})")
-            
-        for board, count, earliest, latest in comment_stats:
-            logger.info(f"  Comments in /{board}/: {count} ({earliest} to {latest})")
+            logger.info(f"  Posts: {posts} ({earliest_post} to {latest_post})")
+            logger.info(f"  Comments in /{board}/: {comments} ({earliest_comment} to {latest_comment})")
         logger.info("========================")
         
     finally:
         cur.close()
-        conn.close()
+        release_connection(conn)
 
 
-def store_thread_data(board, thread_data):
-    """Store thread data using index-based upsert"""
+# Adds an incoming chan_board_stats row to the existing one
+BOARD_STATS_UPSERT = """
+    INSERT INTO chan_board_stats (
+        board, post_count, comment_count,
+        earliest_post, latest_post, earliest_comment, latest_comment
+    )
+    {rows}
+    ON CONFLICT (board) DO UPDATE SET
+        post_count = chan_board_stats.post_count + EXCLUDED.post_count,
+        comment_count = chan_board_stats.comment_count + EXCLUDED.comment_count,
+        earliest_post = LEAST(chan_board_stats.earliest_post, EXCLUDED.earliest_post),
+        latest_post = GREATEST(chan_board_stats.latest_post, EXCLUDED.latest_post),
+        earliest_comment = LEAST(chan_board_stats.earliest_comment, EXCLUDED.earliest_comment),
+        latest_comment = GREATEST(chan_board_stats.latest_comment, EXCLUDED.latest_comment)
+"""
+
+
+def apply_board_stats(cur, deltas):
+    """Add per-board deltas {board: [posts, comments, earliest_post, latest_post, earliest_comment, latest_comment]} to chan_board_stats"""
+    if not deltas:
+        return
+    execute_values(cur, BOARD_STATS_UPSERT.format(rows="VALUES %s"), [
+        (board, posts, comments, earliest_post, latest_post, earliest_comment, latest_comment)
+        for board, (posts, comments, earliest_post, latest_post, earliest_comment, latest_comment) in deltas.items()
+    ])
+
+
+def reconcile_board_stats():
+    """Rebuild chan_board_stats from chan_posts and chan_comments"""
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+
+    try:
+        # Blocks writers' stats updates until the rebuild commits, so rows they
+        # write meanwhile are counted exactly once
+        cur.execute("LOCK TABLE chan_board_stats IN SHARE ROW EXCLUSIVE MODE")
+        cur.execute("DELETE FROM chan_board_stats")
+        cur.execute("""
+            INSERT INTO chan_board_stats (
+                board, post_count, comment_count,
+                earliest_post, latest_post, earliest_comment, latest_comment
+            )
+            SELECT
+                p.board,
+                p.post_count,
+                COALESCE(c.comment_count, 0),
+                p.earliest_post,
+                p.latest_post,
+                c.earliest_comment,
+                c.latest_comment
+            FROM (
+                SELECT board, COUNT(*) AS post_count,
+                       MIN(created_at) AS earliest_post, MAX(created_at) AS latest_post
+                FROM chan_posts
+                GROUP BY board
+            ) p
+            LEFT JOIN (
+                SELECT p.board, COUNT(c.id) AS comment_count,
+                       MIN(c.created_at) AS earliest_comment, MAX(c.created_at) AS latest_comment
+                FROM chan_comments c
+                JOIN chan_posts p ON c.post_id = p.id
+                GROUP BY p.board
+            ) c ON c.board = p.board
+        """)
+        conn.commit()
+        logger.info(f"Rebuilt statistics for {cur.rowcount} boards")
+    except Exception as e:
+        logger.error(f"Error reconciling board statistics: {str(e)}")
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def upsert_comments(cur, comment_values):
+    """
+    Insert or update a thread's comments in one statement and return
+    (added, updated, earliest added, latest added)
+    """
+    if not comment_values:
+        return 0, 0, None, None
+
+    # xmax is 0 only for freshly inserted rows; unchanged comments are not rewritten
+    counts = execute_values(cur, """
+        WITH upserted AS (
+            INSERT INTO chan_comments (post_id, comment_number, data, created_at)
+            VALUES %s
+            ON CONFLICT (post_id, comment_number) DO UPDATE
+            SET data = EXCLUDED.data
+            WHERE chan_comments.data::jsonb IS DISTINCT FROM EXCLUDED.data::jsonb
+            RETURNING (xmax = 0) AS inserted, created_at
+        )
+        SELECT
+            COUNT(*) FILTER (WHERE inserted),
+            COUNT(*) FILTER (WHERE NOT inserted),
+            MIN(created_at) FILTER (WHERE inserted),
+            MAX(created_at) FILTER (WHERE inserted)
+        FROM upserted
+    """, comment_values, page_size=len(comment_values), fetch=True)
+    return counts[0]
+
+
+def parse_thread(board, thread_data):
+    """Convert thread json into the values write_thread upserts; None if the thread has no posts"""
     if not thread_data or "posts" not in thread_data or not thread_data["posts"]:
-        return False
+        return None
 
     main_post = thread_data["posts"][0]
-    thread_number = main_post["no"]
-    post_time = datetime.fromtimestamp(main_post["time"], tz=timezone.utc)
+    return {
+        "board": board,
+        "thread_number": main_post["no"],
+        "main_post": main_post,
+        "post_time": datetime.fromtimestamp(main_post["time"], tz=timezone.utc),
+        # (comment_number, data, created_at); post_id is filled in once the OP row exists
+        "comments": [
+            (
+                comment["no"],
+                Json(comment),
+                datetime.fromtimestamp(comment["time"], tz=timezone.utc)
+            )
+            for comment in thread_data["posts"][1:]
+        ]
+    }
+
+
+def write_thread(cur, thread):
+    """
+    Upsert a parsed thread's OP and comments on an open cursor without committing.
+    Returns the thread's chan_board_stats delta
+    [new posts, new comments, earliest post, latest post, earliest comment, latest comment].
+    """
+    board = thread["board"]
+    main_post = thread["main_post"]
+    thread_number = thread["thread_number"]
+    post_time = thread["post_time"]
     
     logger.info(f"Processing thread {thread_number} on /{board}/ from {post_time}")
+
+    # First check if post exists
+    cur.execute("""
+        SELECT id 
+        FROM chan_posts 
+        WHERE board = %s AND thread_number = %s AND post_number = %s
+    """, (board, thread_number, main_post["no"]))
     
-    conn = psycopg2.connect(dsn=DATABASE_URL)
-    cur = conn.cursor()
+    existing_post = cur.fetchone()
     
+    if existing_post:
+        # Update existing post
+        cur.execute("""
+            UPDATE chan_posts 
+            SET data = %s, 
+                last_checked = %s
+            WHERE id = %s
+            RETURNING id, created_at
+        """, (
+            Json(main_post),
+            datetime.now(timezone.utc),
+            existing_post[0]
+        ))
+        post_id, created_at = cur.fetchone()
+        new_posts = 0
+        logger.info(f"Updated existing thread {thread_number} on /{board}/")
+    else:
+        # Insert new post
+        cur.execute("""
+            INSERT INTO chan_posts (
+                board, 
+                thread_number, 
+                post_number, 
+                data, 
+                created_at,
+                last_checked
+            )
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING id, created_at
+        """, (
+            board,
+            thread_number,
+            main_post["no"],
+            Json(main_post),
+            post_time,
+            datetime.now(timezone.utc)
+        ))
+        post_id, created_at = cur.fetchone()
+        new_posts = 1
+        logger.info(f"Inserted new thread {thread_number} on /{board}/ from {created_at}")
+
+    # Process comments
+    comment_values = [(post_id, *comment) for comment in thread["comments"]]
+    comments_added, comments_updated, earliest_comment, latest_comment = upsert_comments(cur, comment_values)
+
+    if comments_added > 0 or comments_updated > 0:
+        logger.info(f"Thread {thread_number}: Added {comments_added} new comments, updated {comments_updated}")
+
+    post_at = created_at if new_posts else None
+    return [new_posts, comments_added, post_at, post_at, earliest_comment, latest_comment]
+
+
+def merge_stats_delta(total, delta):
+    """Fold one thread's stats delta into a running one"""
+    total[0] += delta[0]
+    total[1] += delta[1]
+    for i, pick in ((2, min), (3, max), (4, min), (5, max)):
+        values = [value for value in (total[i], delta[i]) if value is not None]
+        total[i] = pick(values) if values else None
+
+
+class ThreadWriter:
+    """
+    Writes threads on a single pooled connection and commits every `commit_size`
+    threads. Each thread runs in its own savepoint so one bad thread does not
+    roll back the rest of the batch. `on_commit` callbacks run once the thread
+    they belong to is durable. Board statistics for the batch are summed in
+    memory and applied in one statement just before the commit.
+    """
+
+    def __init__(self, commit_size=10):
+        self.commit_size = commit_size
+        self.conn = None
+        self.cur = None
+        self.uncommitted = []
+        self.stats_deltas = {}
+
+    def write(self, thread, on_commit=None):
+        """Write a parsed thread into the current transaction; returns False if it was not written"""
+        if self.conn is None:
+            self.conn = get_connection_from_pool()
+            self.cur = self.conn.cursor()
+
+        board = thread["board"]
+        thread_number = thread["thread_number"]
+        try:
+            self.cur.execute("SAVEPOINT thread_write")
+            delta = write_thread(self.cur, thread)
+            self.cur.execute("RELEASE SAVEPOINT thread_write")
+        except psycopg2.OperationalError as e:
+            # The connection is gone, and with it the whole uncommitted batch
+            logger.error(f"Lost database connection writing thread {thread_number} on /{board}/: {str(e)}")
+            self.discard()
+            return False
+        except Exception as e:
+            logger.error(f"Error processing thread {thread_number} on /{board}/: {str(e)}")
+            try:
+                self.cur.execute("ROLLBACK TO SAVEPOINT thread_write")
+            except psycopg2.Error:
+                self.discard()
+            return False
+
+        merge_stats_delta(self.stats_deltas.setdefault(board, [0, 0, None, None, None, None]), delta)
+        self.uncommitted.append(on_commit)
+        if len(self.uncommitted) >= self.commit_size:
+            return self.commit()
+        return True
+
+    def commit(self):
+        """Commit the current batch and run its callbacks; returns False if the batch was lost"""
+        if self.conn is None:
+            return True
+        try:
+            apply_board_stats(self.cur, self.stats_deltas)
+            self.conn.commit()
+        except psycopg2.Error as e:
+            logger.error(f"Error committing {len(self.uncommitted)} threads: {str(e)}")
+            self.discard()
+            return False
+
+        callbacks, self.uncommitted = self.uncommitted, []
+        self.stats_deltas = {}
+        for callback in callbacks:
+            if callback:
+                callback()
+        return True
+
+    def discard(self):
+        """Drop the uncommitted batch and the connection it was written on"""
+        if self.uncommitted:
+            logger.warning(f"Discarding {len(self.uncommitted)} uncommitted threads")
+        self.uncommitted = []
+        self.stats_deltas = {}
+        if self.conn is not None:
+            try:
+                self.conn.rollback()
+            except psycopg2.Error:
+                pass
+            self.cur.close()
+            release_connection(self.conn, close=self.conn.closed != 0)
+            self.conn = None
+            self.cur = None
+
+    def close(self):
+        """Commit whatever is pending and return the connection to the pool"""
+        committed = self.commit()
+        if self.conn is not None:
+            self.cur.close()
+            release_connection(self.conn)
+            self.conn = None
+            self.cur = None
+        return committed
+
+
+def store_thread_data(board, thread_data):
+    """Store a single thread in its own transaction (or in the spool when spooling)"""
+    if get_spool() is not None:
+        return spool_thread(board, thread_data)
+
+    thread = parse_thread(board, thread_data)
+    if thread is None:
+        return False
+
+    writer = ThreadWriter(commit_size=1)
+    try:
+        return writer.write(thread)
+    finally:
+        writer.close()
+
+def load_board_state(board=None):
+    """Load the catalog state persisted by previous runs (for one board, or all) into board_state"""
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+
     try:
-        # First check if post exists
         cur.execute("""
-            SELECT id 
-            FROM chan_posts 
-            WHERE board = %s AND thread_number = %s AND post_number = %s
-        """, (board, thread_number, main_post["no"]))
-        
-        existing_post = cur.fetchone()
-        
-        if existing_post:
-            # Update existing post
-            cur.execute("""
-                UPDATE chan_posts 
-                SET data = %s, 
-                    last_checked = %s
-                WHERE id = %s
-                RETURNING id, created_at
-            """, (
-                Json(main_post),
-                datetime.now(timezone.utc),
-                existing_post[0]
-            ))
-            post_id, created_at = cur.fetchone()
-            logger.info(f"Updated existing thread {thread_number} on /{board}/")
-        else:
-            # Insert new post
-            cur.execute("""
-                INSERT INTO chan_posts (
-                    board, 
-                    thread_number, 
-                    post_number, 
-                    data, 
-                    created_at,
-                    last_checked
-                )
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING id, created_at
-            """, (
-                board,
-                thread_number,
-                main_post["no"],
-                Json(main_post),
-                post_time,
-                datetime.now(timezone.utc)
-            ))
-            post_id, created_at = cur.fetchone()
-            logger.info(f"Inserted new thread {thread_number} on /{board}/ from {created_at}")
-
-        # Process comments
-        comments_added = 0
-        comments_updated = 0
-        
-        for comment in thread_data["posts"][1:]:
-            comment_time = datetime.fromtimestamp(comment["time"], tz=timezone.utc)
-            
-            # Check if comment exists
-            cur.execute("""
-                SELECT id 
-                FROM chan_comments 
-                WHERE post_id = %s AND comment_number = %s
-            """, (post_id, comment["no"]))
-            
-            existing_comment = cur.fetchone()
-            
-            if existing_comment:
-                # Update existing comment
-                cur.execute("""
-                    UPDATE chan_comments 
-                    SET data = %s
-                    WHERE id = %s
-                """, (Json(comment), existing_comment[0]))
-                if cur.rowcount > 0:
-                    comments_updated += 1
-            else:
-                # Insert new comment
-                cur.execute("""
-                    INSERT INTO chan_comments (
-                        post_id, 
-                        comment_number, 
-                        data, 
-                        created_at
-                    )
-                    VALUES (%s, %s, %s, %s)
-                """, (
-                    post_id,
-                    comment["no"],
-                    Json(comment),
-                    comment_time
-                ))
-                comments_added += 1
+            SELECT board, thread_number, last_modified, replies, images, page, captured, dead_attempts
+            FROM chan_catalog_state
+            WHERE %(board)s IS NULL OR board = %(board)s
+        """, {"board": board})
+        if board is not None:
+            board_state[board] = {}
+        for board, thread_number, last_modified, replies, images, page, captured, dead_attempts in cur:
+            board_state.setdefault(board, {})[thread_number] = {
+                "state": (last_modified, replies, images),
+                "page": page,
+                "captured": captured,
+                "dead_attempts": dead_attempts
+            }
+        logger.info(f"Loaded catalog state for {len(board_state)} boards")
+    finally:
+        cur.close()
+        release_connection(conn)
+
 
+def save_board_state(board):
+    """Replace a board's persisted catalog state with the in-memory one"""
+    rows = [
+        (board, thread_number, *thread["state"], thread["page"], thread["captured"], thread["dead_attempts"])
+        for thread_number, thread in board_state.get(board, {}).items()
+    ]
+    try:
+        conn = get_connection_from_pool()
+    except Exception:
+        # Keep crawling (e.g. into the spool); the state is saved on the next poll
+        return
+    cur = conn.cursor()
+
+    try:
+        cur.execute("DELETE FROM chan_catalog_state WHERE board = %s", (board,))
+        if rows:
+            execute_values(cur, """
+                INSERT INTO chan_catalog_state (
+                    board, thread_number, last_modified, replies, images, page, captured, dead_attempts
+                )
+                VALUES %s
+            """, rows)
         conn.commit()
-        
-        if comments_added > 0 or comments_updated > 0:
-            logger.info(f"Thread {thread_number}: Added {comments_added} new comments, updated {comments_updated}")
-        
-        return True
-        
     except Exception as e:
-        logger.error(f"Error processing thread {thread_number} on /{board}/: {str(e)}")
+        logger.error(f"Error saving catalog state for /{board}/: {str(e)}")
         conn.rollback()
-        return False
     finally:
         cur.close()
-        conn.close()
+        release_connection(conn)
 
-def collect_and_store_threads(boards):
-    """Collect and store all available threads"""
+
+def catalog_thread_state(thread_preview):
+    """Return the (last_modified, replies, images) state of a catalog thread"""
+    return (
+        thread_preview.get("last_modified"),
+        thread_preview.get("replies", 0),
+        thread_preview.get("images", 0)
+    )
+
+
+def diff_catalog(board, catalog, mode="full"):
+    """
+    Merge a fresh catalog into the board's state and return the thread numbers to fetch.
+    Live threads keep `captured` only while their catalog state is unchanged; threads
+    that left the catalog are kept as dead (in "dead"/"both" mode) until captured.
+    """
+    previous = board_state.get(board, {})
+    last_page = max((page["page"] for page in catalog), default=None)
+    state = {}
+    to_fetch = []
+
+    for page in catalog:
+        for thread_preview in page["threads"]:
+            thread_number = thread_preview["no"]
+            thread_state = catalog_thread_state(thread_preview)
+            known = previous.get(thread_number)
+            captured = known is not None and known["captured"] and known["state"] == thread_state
+            state[thread_number] = {
+                "state": thread_state,
+                "page": page["page"],
+                "captured": captured,
+                "dead_attempts": None
+            }
+            # Dead mode still takes a snapshot of changed threads on the last page,
+            # which are the next to be pruned
+            if not captured and (mode != "dead" or page["page"] == last_page):
+                to_fetch.append(thread_number)
+
+    if mode in ("dead", "both"):
+        for thread_number, known in previous.items():
+            if thread_number not in state:
+                state[thread_number] = dict(known, dead_attempts=known["dead_attempts"] or 0)
+                to_fetch.append(thread_number)
+
+    board_state[board] = state
+    return to_fetch
+
+
+def resolve_missing_dead_threads(board, thread_numbers):
+    """
+    Account for the dead threads among `thread_numbers` whose final state was not stored,
+    whether the fetch or the write failed. Every failure counts toward MAX_DEAD_ATTEMPTS.
+    A thread whose json 404s and that is not in archive.json was pruned before capture
+    and is dropped at once; the rest are retried on later polls.
+    """
+    state = board_state[board]
+    dead = [thread_number for thread_number in thread_numbers
+            if thread_number in state and state[thread_number]["dead_attempts"] is not None]
+    if not dead:
+        return
+
+    not_found = {thread_number for thread_number in dead if chan_client.thread_not_found(board, thread_number)}
+    archived = set(chan_client.get_archive(board) or []) if not_found else set()
+    for thread_number in dead:
+        thread = state[thread_number]
+        thread["dead_attempts"] += 1
+        if thread_number in not_found and thread_number not in archived:
+            logger.warning(f"Lost final state of dead thread {thread_number} on /{board}/, pruned before capture")
+            del state[thread_number]
+        elif thread["dead_attempts"] >= MAX_DEAD_ATTEMPTS:
+            logger.warning(f"Lost final state of dead thread {thread_number} on /{board}/ "
+                           f"after {thread['dead_attempts']} attempts")
+            del state[thread_number]
+        else:
+            logger.info(f"Dead thread {thread_number} on /{board}/ not stored, retrying next poll")
+
+
+async def fetch_and_store_threads(board, thread_numbers, on_stored, max_in_flight=4, commit_size=10,
+                                  queue_size=16):
+    """
+    Run threads through the fetch -> parse -> write pipeline. on_stored(thread_number)
+    runs once a thread's batch is committed.
+    Returns (processed, stored, thread numbers that could not be fetched).
+    """
+    writer = ThreadWriter(commit_size)
+    counts = {"stored": 0}
+
+    def mark_stored(thread_number):
+        counts["stored"] += 1
+        on_stored(thread_number)
+
+    def write_batch(batch):
+        for thread_number, thread in batch:
+            writer.write(thread, functools.partial(mark_stored, thread_number))
+
+    def parse(thread_number, thread_data):
+        return parse_thread(board, thread_data)
+
+    if get_spool() is not None:
+        # Raw json goes to the spool; the loader does the conversion in SQL
+        def write_batch(batch):
+            for thread_number, thread_data in batch:
+                if spool_thread(board, thread_data):
+                    mark_stored(thread_number)
+
+        def parse(thread_number, thread_data):
+            return thread_data
+
+    pipeline = Pipeline(
+        fetch=functools.partial(chan_client.get_thread_async, board),
+        parse=parse,
+        write_batch=write_batch,
+        fetchers=max_in_flight,
+        queue_size=queue_size,
+        batch_size=commit_size
+    )
+    try:
+        stats = await pipeline.run(thread_numbers)
+    finally:
+        await asyncio.get_running_loop().run_in_executor(None, writer.close)
+
+    for stage in stats.values():
+        logger.info(f"/{board}/ {stage.summary()}")
+    return stats["fetch"].items, counts["stored"], pipeline.missing
+
+
+def collect_board(board, mode="full", max_in_flight=4, commit_size=10):
+    """Fetch a board's catalog and store the threads `mode` selects; returns (catalog, threads fetched)"""
+    catalog = chan_client.get_catalog(board)
+    if not catalog:
+        return None, 0
+
+    total_threads = sum(len(page["threads"]) for page in catalog)
+    to_fetch = diff_catalog(board, catalog, mode)
+    state = board_state[board]
+    dead_count = sum(1 for thread_number in to_fetch if state[thread_number]["dead_attempts"] is not None)
+    logger.info(f"Found {total_threads} threads in /{board}/, fetching {len(to_fetch)} ({dead_count} dead)")
+
+    def on_stored(thread_number):
+        if state[thread_number]["dead_attempts"] is not None:
+            # Final state captured; nothing left to track
+            del state[thread_number]
+        else:
+            state[thread_number]["captured"] = True
+
+    threads_processed, threads_stored, _ = asyncio.run(
+        fetch_and_store_threads(board, to_fetch, on_stored, max_in_flight, commit_size)
+    )
+    # Dead threads that were stored are gone from the state; the rest failed to fetch or write
+    resolve_missing_dead_threads(board, to_fetch)
+    save_board_state(board)
+    logger.info(f"/{board}/ done: {threads_processed} processed, {threads_stored} stored")
+    return catalog, threads_processed
+
+
+def collect_and_store_threads(boards, mode="full", max_in_flight=4, commit_size=10):
+    """Collect and store all new or changed threads"""
     logger.info("Starting collection")
     print_db_stats()
     
     for board in boards:
-        threads_processed = 0
-        threads_stored = 0
-        
         try:
-            catalog = chan_client.get_catalog(board)
-            if not catalog:
-                continue
-                
-            total_threads = sum(len(page["threads"]) for page in catalog)
-            logger.info(f"Found {total_threads} threads in /{board}/")
-            
-            for page in catalog:
-                for thread_preview in page["threads"]:
-                    thread_number = thread_preview["no"]
-                    threads_processed += 1
-                    
-                    thread_data = chan_client.get_thread(board, thread_number)
-                    if thread_data and store_thread_data(board, thread_data):
-                        threads_stored += 1
-                            
-                    if threads_processed % 10 == 0:
-                        logger.info(f"/{board}/ progress: {threads_processed}/{total_threads} processed, {threads_stored} stored")
-                    time.sleep(1)
-                    
+            collect_board(board, mode, max_in_flight, commit_size)
         except Exception as e:
             logger.error(f"Error processing board {board}: {str(e)}")
     
     logger.info("Collection completed")
     print_db_stats()
-def continuous_collection(boards, delay=120):
-    """Main collection function"""
-    cycle_count = 0
+
+
+def continuous_collection(boards, mode="full", delay=120, max_in_flight=4, commit_size=10,
+                          min_interval=30, max_interval=900, request_budget=1.0):
+    """Main collection function: poll each board when the scheduler says it is due"""
+    scheduler = BoardScheduler(
+        boards,
+        initial_interval=delay,
+        min_interval=min_interval,
+        max_interval=max_interval,
+        request_budget=request_budget
+    )
+    poll_count = 0
     
     while True:
+        board = scheduler.next_board()
+        poll_count += 1
         try:
-            cycle_count += 1
-            logger.info(f"\n=== Starting Collection Cycle {cycle_count} ===")
-            
-            collect_and_store_threads(boards)
-            
-            logger.info(f"Cycle {cycle_count} completed. Waiting {delay} seconds...")
-            time.sleep(delay)
-            
+            catalog, threads_fetched = collect_board(board, mode, max_in_flight, commit_size)
+            if catalog is None:
+                scheduler.reschedule(board, delay)
+                continue
         except Exception as e:
-            logger.error(f"Error in cycle {cycle_count}: {str(e)}")
-            time.sleep(delay)
+            logger.error(f"Error polling /{board}/: {str(e)}")
+            scheduler.reschedule(board, delay)
+            continue
+
+        interval = scheduler.record_poll(board, catalog, 1 + threads_fetched)
+        logger.info(f"Next poll of /{board}/ in {interval:.0f} seconds")
+
+        if get_spool() is not None:
+            get_spool().rotate_if_due()
+
+        # Roughly once per pass over all boards; the crawl carries on if the database is down
+        if poll_count % len(scheduler.boards) == 0:
+            try:
+                print_db_stats()
+            except Exception as e:
+                logger.error(f"Error reading database statistics: {str(e)}")
+
+
+def get_boards_from_file(file_path="boards.txt"):
+    """Read the boards to crawl, one per line"""
+    try:
+        with open(file_path, 'r') as file:
+            boards = [line.strip() for line in file if line.strip()]
+        logger.info(f"Loaded boards from file: {boards}")
+        return boards
+    except FileNotFoundError:
+        logger.error(f"File {file_path} not found. Using default boards.")
+        return ["pol", "sci", "news"]
+
+
 if __name__ == "__main__":
-    target_boards = ["pol", "news", "sci"]
+    parser = argparse.ArgumentParser(description="Crawl 4chan boards listed in boards.txt")
+    parser.add_argument("--mode", choices=CRAWL_MODES, default="full",
+                        help="full: store new/changed threads, dead: store threads as they leave the catalog, both: do both")
+    parser.add_argument("--reconcile-stats", action="store_true",
+                        help="rebuild chan_board_stats from chan_posts/chan_comments and exit")
+    args = parser.parse_args()
+
+    if args.reconcile_stats:
+        ensure_schema()
+        reconcile_board_stats()
+        raise SystemExit(0)
+
+    target_boards = get_boards_from_file()
     
-    logger.info(f"Starting crawler for boards: {', '.join(target_boards)}")
+    logger.info(f"Starting {args.mode} crawler for boards: {', '.join(target_boards)}")
+    ensure_schema()
+    load_board_state()
     
     continuous_collection(
         boards=target_boards,
-        delay=120
+        mode=args.mode,
+        delay=120,
+        max_in_flight=4,
+        commit_size=10,
+        min_interval=30,
+        max_interval=900,
+        request_budget=1.0
     )
-
@@ -0,0 +1,152 @@
+# Staged fetch -> parse -> write pipeline joined by bounded queues
+
+import asyncio
+import logging
+import time
+
+# Logger setup
+logger = logging.getLogger("4chan pipeline")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Marks the end of the stream on a queue
+DONE = object()
+
+
+class StageStats:
+    """Throughput counters for one pipeline stage"""
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.failed = 0
+        self.busy = 0.0  # seconds spent working, not waiting on a queue
+        self.started = time.monotonic()
+
+    def record(self, started, items=1):
+        self.items += items
+        self.busy += time.monotonic() - started
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        busy_rate = self.items / self.busy if self.busy else 0.0
+        return (f"{self.name}: {self.items} items ({self.failed} failed) in {elapsed:.1f}s, "
+                f"{self.items / elapsed:.2f}/s overall, {busy_rate:.2f}/s per busy worker, "
+                f"{100 * self.busy / (elapsed * self.workers):.0f}% utilised")
+
+
+class Pipeline:
+    """
+    Runs items through three stages so the network, the CPU and the database
+    all stay busy at once:
+
+    - `fetchers` coroutines await `fetch(item)` (which does its own rate limiting)
+    - one parser runs `parse(item, fetched)` on the executor
+    - one writer runs `write_batch([(item, parsed), ...])` on the executor with
+      up to `batch_size` parsed items at a time
+
+    Stages are joined by queues holding at most `queue_size` items, so a slow
+    writer holds back parsing and a slow parser holds back fetching instead of
+    letting work pile up in memory. Items whose fetch returns None are collected
+    in `missing`. When the input is exhausted every stage drains its queue
+    before the pipeline returns.
+    """
+
+    def __init__(self, fetch, parse, write_batch, fetchers=4, queue_size=16, batch_size=10):
+        self.fetch = fetch
+        self.parse = parse
+        self.write_batch = write_batch
+        self.fetchers = fetchers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.stats = {
+            "fetch": StageStats("fetch", fetchers),
+            "parse": StageStats("parse"),
+            "write": StageStats("write"),
+        }
+        self.missing = []
+
+    async def run(self, items):
+        loop = asyncio.get_running_loop()
+        pending = iter(items)
+        parse_queue = asyncio.Queue(self.queue_size)
+        write_queue = asyncio.Queue(self.queue_size)
+
+        async def fetch_stage():
+            stats = self.stats["fetch"]
+            # Fetchers share one iterator; it is only advanced between awaits
+            for item in pending:
+                started = time.monotonic()
+                try:
+                    fetched = await self.fetch(item)
+                except Exception as e:
+                    logger.error(f"Fetch of {item} failed: {e}")
+                    fetched = None
+                stats.record(started)
+                if fetched is None:
+                    stats.failed += 1
+                    self.missing.append(item)
+                    continue
+                await parse_queue.put((item, fetched))
+
+        async def parse_stage():
+            stats = self.stats["parse"]
+            while True:
+                entry = await parse_queue.get()
+                if entry is DONE:
+                    await write_queue.put(DONE)
+                    return
+                item, fetched = entry
+                started = time.monotonic()
+                try:
+                    parsed = await loop.run_in_executor(None, self.parse, item, fetched)
+                except Exception as e:
+                    logger.error(f"Parse of {item} failed: {e}")
+                    parsed = None
+                stats.record(started)
+                if parsed is None:
+                    stats.failed += 1
+                    continue
+                await write_queue.put((item, parsed))
+
+        async def write_stage():
+            stats = self.stats["write"]
+            done = False
+            while not done:
+                batch = []
+                entry = await write_queue.get()
+                # Take whatever else is already waiting, up to a full batch
+                while entry is not DONE:
+                    batch.append(entry)
+                    if len(batch) >= self.batch_size or write_queue.empty():
+                        break
+                    entry = write_queue.get_nowait()
+                done = entry is DONE
+                if not batch:
+                    continue
+                started = time.monotonic()
+                try:
+                    await loop.run_in_executor(None, self.write_batch, batch)
+                except Exception as e:
+                    stats.failed += len(batch)
+                    logger.error(f"Write of {len(batch)} items failed: {e}")
+                stats.record(started, len(batch))
+
+        parse_task = asyncio.ensure_future(parse_stage())
+        write_task = asyncio.ensure_future(write_stage())
+        fetch_tasks = [asyncio.ensure_future(fetch_stage()) for _ in range(self.fetchers)]
+        try:
+            await asyncio.gather(*fetch_tasks)
+        finally:
+            for task in fetch_tasks:
+                task.cancel()
+            # Drain: the end marker follows everything already queued through each stage
+            await parse_queue.put(DONE)
+            await parse_task
+            await write_task
+        return self.stats
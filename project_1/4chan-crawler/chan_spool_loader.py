@@ -0,0 +1,203 @@
+# Bulk loader for the 4chan crawler's spool: COPYs sealed segments into a staging
+# table, merges them into chan_posts/chan_comments and checkpoints each segment
+
+import argparse
+import json
+import logging
+import os
+import time
+
+from chan_crawler import (
+    BOARD_STATS_UPSERT,
+    SPOOL_DIR,
+    ensure_schema,
+    get_connection_from_pool,
+    release_connection,
+)
+from spool import CopyStream, copy_text, read_segment, sealed_segments
+
+# Logger setup
+logger = logging.getLogger("4chan spool loader")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+def ensure_checkpoint_table():
+    """Create the table recording which segments have been loaded"""
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS chan_spool_checkpoint (
+                segment TEXT PRIMARY KEY,
+                records INTEGER NOT NULL,
+                loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        conn.commit()
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def staging_lines(path):
+    """COPY text-format lines (board, fetched_at, thread) for a segment's records"""
+    for record in read_segment(path):
+        yield "\t".join((
+            copy_text(record["board"]),
+            copy_text(record["fetched_at"]),
+            copy_text(json.dumps(record["thread"], separators=(",", ":")))
+        )) + "\n"
+
+
+def merge_staged_threads(cur):
+    """Merge the staged threads into chan_posts/chan_comments and chan_board_stats"""
+    # Latest snapshot of each thread in the segment
+    cur.execute("""
+        CREATE TEMP TABLE chan_spool_threads ON COMMIT DROP AS
+        SELECT DISTINCT ON (board, thread_number) board, thread_number, posts
+        FROM (
+            SELECT board, fetched_at, (thread->'posts'->0->>'no')::bigint AS thread_number, thread->'posts' AS posts
+            FROM chan_spool_staging
+        ) staged
+        ORDER BY board, thread_number, fetched_at DESC
+    """)
+
+    cur.execute("""
+        UPDATE chan_posts p
+        SET data = t.posts->0,
+            last_checked = now()
+        FROM chan_spool_threads t
+        WHERE p.board = t.board AND p.thread_number = t.thread_number AND p.post_number = t.thread_number
+    """)
+    updated_posts = cur.rowcount
+
+    cur.execute(f"""
+        WITH new_posts AS (
+            INSERT INTO chan_posts (board, thread_number, post_number, data, created_at, last_checked)
+            SELECT t.board, t.thread_number, t.thread_number, t.posts->0,
+                   to_timestamp((t.posts->0->>'time')::bigint), now()
+            FROM chan_spool_threads t
+            WHERE NOT EXISTS (
+                SELECT 1 FROM chan_posts p
+                WHERE p.board = t.board AND p.thread_number = t.thread_number AND p.post_number = t.thread_number
+            )
+            RETURNING board, created_at
+        )
+        {BOARD_STATS_UPSERT.format(rows='''
+            SELECT board, COUNT(*), 0, MIN(created_at), MAX(created_at), NULL::timestamptz, NULL::timestamptz
+            FROM new_posts
+            GROUP BY board
+        ''')}
+    """)
+
+    cur.execute(f"""
+        WITH upserted AS (
+            INSERT INTO chan_comments (post_id, comment_number, data, created_at)
+            SELECT p.id, (c.post->>'no')::bigint, c.post, to_timestamp((c.post->>'time')::bigint)
+            FROM chan_spool_threads t
+            JOIN chan_posts p
+              ON p.board = t.board AND p.thread_number = t.thread_number AND p.post_number = t.thread_number
+            CROSS JOIN LATERAL jsonb_array_elements(t.posts) WITH ORDINALITY AS c(post, position)
+            WHERE c.position > 1
+            ON CONFLICT (post_id, comment_number) DO UPDATE
+            SET data = EXCLUDED.data
+            WHERE chan_comments.data::jsonb IS DISTINCT FROM EXCLUDED.data::jsonb
+            RETURNING (xmax = 0) AS inserted, post_id, created_at
+        ), added AS (
+            SELECT p.board, COUNT(*) AS comments, MIN(u.created_at) AS earliest, MAX(u.created_at) AS latest
+            FROM upserted u
+            JOIN chan_posts p ON p.id = u.post_id
+            WHERE u.inserted
+            GROUP BY p.board
+        )
+        {BOARD_STATS_UPSERT.format(rows='''
+            SELECT board, 0, comments, NULL::timestamptz, NULL::timestamptz, earliest, latest
+            FROM added
+        ''')}
+    """)
+    return updated_posts
+
+
+def load_segment(path, reload=False):
+    """Load one sealed segment in a single transaction; returns the records loaded, or None if skipped"""
+    segment = os.path.basename(path)
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+
+    try:
+        if not reload:
+            cur.execute("SELECT 1 FROM chan_spool_checkpoint WHERE segment = %s", (segment,))
+            if cur.fetchone():
+                conn.commit()
+                return None
+
+        cur.execute("""
+            CREATE TEMP TABLE chan_spool_staging (
+                board TEXT,
+                fetched_at DOUBLE PRECISION,
+                thread JSONB
+            ) ON COMMIT DROP
+        """)
+        cur.copy_expert(
+            "COPY chan_spool_staging (board, fetched_at, thread) FROM STDIN",
+            CopyStream(staging_lines(path))
+        )
+        records = cur.rowcount
+        merge_staged_threads(cur)
+
+        # Same transaction as the merge, so a segment is loaded exactly once
+        cur.execute("""
+            INSERT INTO chan_spool_checkpoint (segment, records)
+            VALUES (%s, %s)
+            ON CONFLICT (segment) DO UPDATE SET records = EXCLUDED.records, loaded_at = now()
+        """, (segment, records))
+        conn.commit()
+        logger.info(f"Loaded {records} threads from {segment}")
+        return records
+    except Exception as e:
+        logger.error(f"Error loading {segment}: {str(e)}")
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def load_spool(spool_dir, reload=False, delete=False):
+    """Load every sealed segment in write order; returns the number of segments loaded"""
+    loaded = 0
+    for path in sealed_segments(spool_dir, "chan"):
+        if load_segment(path, reload) is not None:
+            loaded += 1
+        if delete:
+            os.remove(path)
+    return loaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load spooled 4chan threads into Postgres")
+    parser.add_argument("--spool-dir", default=SPOOL_DIR, required=not SPOOL_DIR)
+    parser.add_argument("--reload", action="store_true",
+                        help="load segments again even if already checkpointed (e.g. after a schema change)")
+    parser.add_argument("--delete", action="store_true", help="delete segments once loaded")
+    parser.add_argument("--follow", type=int, metavar="SECONDS",
+                        help="keep running, checking for new segments every SECONDS")
+    args = parser.parse_args()
+
+    ensure_schema()
+    ensure_checkpoint_table()
+
+    while True:
+        try:
+            segments = load_spool(args.spool_dir, args.reload, args.delete)
+            logger.info(f"Loaded {segments} segments")
+        except Exception as e:
+            logger.error(f"Loading stopped: {str(e)}")
+        if not args.follow:
+            break
+        time.sleep(args.follow)
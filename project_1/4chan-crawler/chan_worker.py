@@ -0,0 +1,306 @@
+# Faktory worker for the 4chan crawler: consumes crawl-catalog and crawl-thread jobs
+# for a subset of board shards so crawling can be spread across machines
+
+import argparse
+import logging
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from pyfaktory import Client, Consumer, Job, Producer
+
+import chan_crawler
+from chan_crawler import (
+    CRAWL_MODES,
+    board_state,
+    diff_catalog,
+    get_boards_from_file,
+    get_connection_from_pool,
+    load_board_state,
+    release_connection,
+    resolve_missing_dead_threads,
+    save_board_state,
+    store_thread_data,
+)
+
+# Load environment variables
+load_dotenv()
+FAKTORY_SERVER_URL = os.environ.get("FAKTORY_SERVER_URL")
+# Number of queue shards per job type; every worker and producer must agree on it
+QUEUE_SHARDS = int(os.environ.get("CHAN_QUEUE_SHARDS", "4"))
+# Seconds between catalog crawls of the same board
+CATALOG_INTERVAL = int(os.environ.get("CHAN_CATALOG_INTERVAL", "120"))
+
+# Logger setup
+logger = logging.getLogger("4chan worker")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+def shard_for_board(board, shards=QUEUE_SHARDS):
+    """
+    Rendezvous-hash a board onto a shard. The mapping is stable across processes and
+    machines, and changing the shard count only moves the boards of added/removed shards.
+    """
+    return max(range(shards), key=lambda shard: zlib.crc32(f"{shard}/{board}".encode()))
+
+
+def queue_for_board(board, jobtype, shards=QUEUE_SHARDS):
+    """Queue a board's `jobtype` jobs go to, e.g. crawl-thread-2"""
+    return f"{jobtype}-{shard_for_board(board, shards)}"
+
+
+@contextmanager
+def advisory_lock(key, wait=False):
+    """
+    Hold a Postgres advisory lock on `key` for the duration of the block. Yields whether
+    the lock was taken; with wait=False another worker holding it yields False at once.
+    The lock dies with the connection, so a crashed worker never leaves it behind.
+    """
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+    acquired = False
+    try:
+        if wait:
+            cur.execute("SELECT pg_advisory_lock(hashtextextended(%s, 0))", (key,))
+            acquired = True
+        else:
+            cur.execute("SELECT pg_try_advisory_lock(hashtextextended(%s, 0))", (key,))
+            acquired = cur.fetchone()[0]
+        conn.commit()
+        yield acquired
+    finally:
+        if acquired:
+            cur.execute("SELECT pg_advisory_unlock(hashtextextended(%s, 0))", (key,))
+            conn.commit()
+        cur.close()
+        release_connection(conn)
+
+
+def board_lock(board, wait=False):
+    """Lock serialising updates to one board's chan_catalog_state rows"""
+    return advisory_lock(f"chan_catalog_state/{board}", wait)
+
+
+def catalog_lock(board):
+    """Lock held by the one crawl-catalog job of a board's chain; only catalog jobs take it"""
+    return advisory_lock(f"chan_catalog/{board}")
+
+
+def thread_lock(board, thread_number):
+    """Lock making sure a thread is only crawled by one worker at a time"""
+    return advisory_lock(f"chan_thread/{board}/{thread_number}")
+
+
+def use_worker_client(concurrency):
+    """
+    Give each of the consumer's `concurrency` job processes its own share of the host's
+    1 request/second budget. Called once before the consumer forks its processes.
+    """
+    client = chan_crawler.chan_client
+    client.rate_limiter.rate = 1.0 / max(1, concurrency)
+
+
+def thread_needs_crawl(board, thread_number, last_modified):
+    """
+    False if the thread was already stored at the catalog state this job was queued for,
+    or if the catalog has moved on to a newer state: the job queued for that state
+    fetches the thread instead, so a backlog never fetches a changed thread twice.
+    """
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT last_modified IS NOT DISTINCT FROM %s AND NOT (captured AND dead_attempts IS NULL)
+            FROM chan_catalog_state
+            WHERE board = %s AND thread_number = %s
+        """, (last_modified, board, thread_number))
+        row = cur.fetchone()
+        conn.commit()
+        # Threads no longer tracked (pruned in full mode) still get their last fetch
+        return row is None or row[0]
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def mark_thread_captured(board, thread_number, last_modified):
+    """Record a stored thread: live threads become captured, dead ones stop being tracked"""
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE chan_catalog_state
+            SET captured = TRUE
+            WHERE board = %s AND thread_number = %s
+              AND dead_attempts IS NULL
+              AND last_modified IS NOT DISTINCT FROM %s
+        """, (board, thread_number, last_modified))
+        cur.execute("""
+            DELETE FROM chan_catalog_state
+            WHERE board = %s AND thread_number = %s AND dead_attempts IS NOT NULL
+        """, (board, thread_number))
+        conn.commit()
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def get_catalog_schedule(board):
+    """When the live crawl-catalog chain of a board is next due, or None if it has none"""
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT scheduled_at FROM chan_catalog_chain WHERE board = %s", (board,))
+        row = cur.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def set_catalog_schedule(board, scheduled_at):
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO chan_catalog_chain (board, scheduled_at)
+            VALUES (%s, %s)
+            ON CONFLICT (board) DO UPDATE SET scheduled_at = EXCLUDED.scheduled_at
+        """, (board, scheduled_at))
+        conn.commit()
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def crawl_thread(board, thread_number, last_modified=None):
+    """Fetch and store one thread unless another worker already has it"""
+    with thread_lock(board, thread_number) as acquired:
+        if not acquired:
+            logger.info(f"Thread {thread_number} on /{board}/ is being crawled by another worker, skipping")
+            return
+        if not thread_needs_crawl(board, thread_number, last_modified):
+            logger.info(f"Thread {thread_number} on /{board}/ already stored or superseded, skipping")
+            return
+
+        thread_data = chan_crawler.chan_client.get_thread(board, thread_number)
+        with board_lock(board, wait=True):
+            if thread_data and store_thread_data(board, thread_data):
+                mark_thread_captured(board, thread_number, last_modified)
+            else:
+                load_board_state(board)
+                if thread_number in board_state[board]:
+                    resolve_missing_dead_threads(board, [thread_number])
+                    save_board_state(board)
+
+
+def crawl_catalog(board, mode="full", scheduled_at=None):
+    """
+    Diff a board's catalog, enqueue the threads to crawl and schedule the next catalog
+    crawl. The next run is recorded in chan_catalog_chain; a scheduled job that no
+    longer matches it was superseded and is dropped. A job without `scheduled_at` (a
+    seed or cold start) always runs and takes the chain over, so seeding a board twice
+    never leaves it with two chains.
+    """
+    logger.info(f"Starting catalog crawl for board: {board}")
+    scheduled_at = scheduled_at and datetime.fromisoformat(scheduled_at)
+    with catalog_lock(board) as acquired:
+        if not acquired:
+            # Another catalog job for this board is running and will schedule the next crawl
+            logger.info(f"Catalog of /{board}/ is being crawled by another worker, skipping")
+            return
+        if scheduled_at and get_catalog_schedule(board) != scheduled_at:
+            logger.info(f"Catalog crawl of /{board}/ at {scheduled_at} was superseded, skipping")
+            return
+
+        catalog = chan_crawler.chan_client.get_catalog(board)
+        jobs = []
+        if catalog:
+            # Thread jobs storing into this board hold board_lock only briefly
+            with board_lock(board, wait=True):
+                load_board_state(board)
+                to_fetch = diff_catalog(board, catalog, mode)
+                save_board_state(board)
+
+            state = board_state[board]
+            queue = queue_for_board(board, "crawl-thread")
+            for thread_number in to_fetch:
+                last_modified = state[thread_number]["state"][0]
+                jobs.append(Job(
+                    jobtype="crawl-thread",
+                    args=(board, thread_number, last_modified),
+                    queue=queue
+                ))
+
+        run_at = datetime.now(timezone.utc) + timedelta(seconds=CATALOG_INTERVAL)
+        with Client(faktory_url=FAKTORY_SERVER_URL, role="producer") as client:
+            producer = Producer(client=client)
+            if jobs:
+                logger.info(f"Enqueuing {len(jobs)} thread jobs for board: {board}")
+                producer.push_bulk(jobs)
+            producer.push(Job(
+                jobtype="crawl-catalog",
+                args=(board, mode, run_at.isoformat()),
+                queue=queue_for_board(board, "crawl-catalog"),
+                at=run_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+            ))
+        # Recorded after the push: if this fails, the retried job still matches the old schedule
+        set_catalog_schedule(board, run_at)
+        logger.info(f"Scheduled next catalog crawl for board: {board} at {run_at}")
+
+
+def enqueue_boards(boards, mode="full"):
+    """Push an initial crawl-catalog job for each board onto its shard's queue"""
+    with Client(faktory_url=FAKTORY_SERVER_URL, role="producer") as client:
+        producer = Producer(client=client)
+        for board in boards:
+            producer.push(Job(
+                jobtype="crawl-catalog",
+                args=(board, mode),
+                queue=queue_for_board(board, "crawl-catalog")
+            ))
+            logger.info(f"Enqueued catalog crawl for /{board}/ on {queue_for_board(board, 'crawl-catalog')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Faktory worker for the 4chan crawler")
+    parser.add_argument("--shards", type=int, nargs="*", default=list(range(QUEUE_SHARDS)),
+                        help="shard numbers this worker consumes (default: all)")
+    parser.add_argument("--concurrency", type=int, default=5, help="jobs run at the same time")
+    parser.add_argument("--mode", choices=CRAWL_MODES, default="full")
+    parser.add_argument("--seed", action="store_true",
+                        help="enqueue a catalog crawl for every board in boards.txt on the selected shards")
+    args = parser.parse_args()
+
+    chan_crawler.ensure_schema()
+
+    if args.seed:
+        boards = [board for board in get_boards_from_file() if shard_for_board(board) in args.shards]
+        enqueue_boards(boards, args.mode)
+
+    use_worker_client(args.concurrency)
+
+    # Catalog queues first so diffs are never starved by a backlog of thread jobs
+    queues = [f"crawl-catalog-{shard}" for shard in args.shards] + \
+             [f"crawl-thread-{shard}" for shard in args.shards]
+    logger.info(f"Starting worker on queues: {queues}")
+
+    while True:
+        try:
+            with Client(faktory_url=FAKTORY_SERVER_URL, role="consumer") as client:
+                consumer = Consumer(client=client, queues=queues, priority="strict", concurrency=args.concurrency)
+                consumer.register("crawl-catalog", crawl_catalog)
+                consumer.register("crawl-thread", crawl_thread)
+                consumer.run()
+        except Exception as e:
+            logger.error(f"An error occurred: {e}")
+            time.sleep(30)
@@ -3,6 +3,7 @@ from pyfaktory import Client, Consumer, Job, Producer
 import time
 import random
 import sys
+from chan_worker import queue_for_board
 
 logger = logging.getLogger("faktory test")
 logger.propagate = False
@@ -21,5 +22,5 @@ if __name__ == "__main__":
 
     with Client(faktory_url=faktory_server_url, role="producer") as client:
         producer = Producer(client=client)
-        job = Job(jobtype="crawl-catalog", args=(board,), queue="crawl-catalog")
+        job = Job(jobtype="crawl-catalog", args=(board,), queue=queue_for_board(board, "crawl-catalog"))
         producer.push(job)
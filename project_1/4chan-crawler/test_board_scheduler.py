@@ -0,0 +1,34 @@
+from board_scheduler import BoardScheduler
+
+
+def make_catalog(threads, page_size=15):
+    """Build a catalog from {thread_number: replies}, split into pages like the 4chan API"""
+    items = [{"no": no, "replies": replies} for no, replies in threads.items()]
+    return [
+        {"page": index + 1, "threads": items[start:start + page_size]}
+        for index, start in enumerate(range(0, len(items), page_size))
+    ]
+
+
+def test_first_poll_keeps_initial_interval():
+    scheduler = BoardScheduler(["pol", "sci"], initial_interval=120)
+    catalog = make_catalog({no: 10 for no in range(1, 151)})
+    assert scheduler.record_poll("pol", catalog, 1) == 120
+
+
+def test_busy_board_polls_sooner():
+    scheduler = BoardScheduler(["pol"], initial_interval=120, min_interval=30)
+    scheduler.record_poll("pol", make_catalog({no: 10 for no in range(1, 151)}), 1)
+    stats = scheduler.boards["pol"]
+    stats["polled_at"] -= 60
+    interval = scheduler.record_poll("pol", make_catalog({no: 20 for no in range(1, 151)}), 1)
+    # 1500 new posts in 60 s is well past target_new_posts per interval
+    assert interval == 30
+
+
+def test_quiet_board_backs_off_to_max_interval():
+    scheduler = BoardScheduler(["sci"], initial_interval=120, max_interval=900)
+    catalog = make_catalog({no: 5 for no in range(1, 151)})
+    scheduler.record_poll("sci", catalog, 1)
+    scheduler.boards["sci"]["polled_at"] -= 120
+    assert scheduler.record_poll("sci", catalog, 1) == 900
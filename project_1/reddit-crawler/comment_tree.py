@@ -0,0 +1,69 @@
+# Flattening of Reddit comment trees, including the replies hidden behind "more" stubs
+
+# Most comment ids /api/morechildren expands per request
+MORE_CHILDREN_BATCH = 100
+
+
+def walk_comment_tree(children, base_depth=0):
+    """
+    Walk a comment listing depth first, in display order, without recursion (threads
+    can nest deeper than Python's recursion limit). Yields (kind, data, depth) for every
+    thing in the tree: "t1" comments and the "more" stubs standing in for hidden replies.
+    """
+    stack = [(iter(children), base_depth)]
+    while stack:
+        siblings, depth = stack[-1]
+        child = next(siblings, None)
+        if child is None:
+            stack.pop()
+            continue
+        yield child["kind"], child["data"], depth
+        replies = child["data"].get("replies") if child["kind"] == "t1" else None
+        # Reddit sends "" rather than an empty listing for comments without replies
+        if replies:
+            stack.append((iter(replies["data"]["children"]), depth + 1))
+
+
+class CommentTree:
+    """
+    Collects the comments of one post as a flat list, each with its `parent_id` and
+    `depth`. "More" stubs are queued by id; `pending_batches()` hands them out in
+    batches for /api/morechildren, whose flat results go back in through `add_things()`.
+    Deep threads Reddit cuts off with a "continue this thread" stub (a "more" with no
+    ids) are listed in `continuations` by the id of the comment they continue.
+    """
+
+    def __init__(self):
+        self.comments = []
+        self.seen = set()
+        self.more_ids = []
+        self.continuations = []
+
+    def add_listing(self, children, base_depth=0):
+        """Add a nested comment listing, as returned by /comments/<post_id>."""
+        for kind, data, depth in walk_comment_tree(children, base_depth):
+            self.add(kind, data, depth)
+
+    def add_things(self, things):
+        """Add the flat list of things returned by /api/morechildren."""
+        for thing in things:
+            self.add(thing["kind"], thing["data"], thing["data"].get("depth", 0))
+
+    def add(self, kind, data, depth):
+        if kind == "t1":
+            if data["id"] in self.seen:
+                return
+            self.seen.add(data["id"])
+            data["depth"] = depth
+            self.comments.append({"kind": kind, "data": data})
+        elif kind == "more":
+            if data.get("children"):
+                self.more_ids.extend(data["children"])
+            elif data.get("parent_id", "").startswith("t1_"):
+                self.continuations.append((data["parent_id"][3:], depth))
+
+    def pending_batches(self):
+        """Take the queued "more" ids in /api/morechildren sized batches."""
+        while self.more_ids:
+            batch, self.more_ids = self.more_ids[:MORE_CHILDREN_BATCH], self.more_ids[MORE_CHILDREN_BATCH:]
+            yield batch
@@ -0,0 +1,60 @@
+# Shared http session layer: connection pooling, keep-alive, timeouts and retries
+
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeout in seconds applied to every request without its own
+DEFAULT_TIMEOUT = (5, 30)
+
+_shared_session = None
+_shared_session_pid = None
+_shared_session_lock = threading.Lock()
+
+
+class TimeoutSession(requests.Session):
+    """requests.Session that applies a default timeout to every request"""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def build_session(pool_size=10, timeout=DEFAULT_TIMEOUT, retries=3, backoff_factor=0.5):
+    """
+    Build a keep-alive session that pools up to `pool_size` connections per host
+    and retries connection errors and 5xx responses at the transport level
+    """
+    session = TimeoutSession(timeout)
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(500, 502, 503, 504),
+        # A 429 with Retry-After is otherwise retried here, out of sight of the rate limiters
+        respect_retry_after_header=False,
+        # Hand the last response back to the caller instead of raising RetryError
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(**kwargs):
+    """
+    Return the process-wide shared session, building it with `kwargs` on first use.
+    A forked worker gets its own session rather than the parent's sockets.
+    """
+    global _shared_session, _shared_session_pid
+    with _shared_session_lock:
+        if _shared_session is None or _shared_session_pid != os.getpid():
+            _shared_session = build_session(**kwargs)
+            _shared_session_pid = os.getpid()
+        return _shared_session
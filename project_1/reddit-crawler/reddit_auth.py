@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:  # Windows: the token is still cached, just not shared between processes
+    fcntl = None
+
+# Load environment variables
+load_dotenv()
+REDDIT_CLIENT_ID = os.getenv("REDDIT_CLIENT_ID")
+REDDIT_CLIENT_SECRET = os.getenv("REDDIT_CLIENT_SECRET")
+REDDIT_USER_AGENT = os.getenv("REDDIT_USER_AGENT")
+REDDIT_USERNAME = os.getenv("REDDIT_USERNAME")
+REDDIT_PASSWORD = os.getenv("REDDIT_PASSWORD")
+# Where workers on this machine share the access token
+REDDIT_TOKEN_CACHE = os.getenv("REDDIT_TOKEN_CACHE") or os.path.join(
+    tempfile.gettempdir(), f"reddit_token_{REDDIT_CLIENT_ID}.json"
+)
+
+# Logger setup
+logger = logging.getLogger("reddit_auth")
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+class TokenManager:
+    """
+    Holds the OAuth access token and its expiry. The token is fetched with the password
+    grant only when there is none or it expires within `refresh_margin` seconds, and
+    is cached in `cache_path` under a file lock so every worker on the machine shares
+    one token instead of each authenticating on its own.
+    """
+
+    def __init__(self, session, cache_path=REDDIT_TOKEN_CACHE, refresh_margin=300):
+        self.session = session
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin
+        self.access_token = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+
+    def token(self):
+        """Return a token valid for at least `refresh_margin` seconds, refreshing it if needed."""
+        with self.lock:
+            if self.fresh(self.expires_at):
+                return self.access_token
+            with self.file_lock():
+                cached = self.read_cache()
+                if cached and self.fresh(cached["expires_at"]):
+                    self.access_token, self.expires_at = cached["access_token"], cached["expires_at"]
+                else:
+                    self.request_token()
+                    self.write_cache()
+            return self.access_token
+
+    def invalidate(self, token):
+        """Drop a token Reddit rejected with a 401, unless another worker already replaced it."""
+        with self.lock:
+            with self.file_lock():
+                cached = self.read_cache()
+                if cached and cached["access_token"] == token:
+                    os.remove(self.cache_path)
+            if self.access_token == token:
+                self.access_token = None
+                self.expires_at = 0.0
+
+    def fresh(self, expires_at):
+        return expires_at - time.time() > self.refresh_margin
+
+    def request_token(self):
+        """Authenticate with Reddit API and retrieve access token."""
+        auth = requests.auth.HTTPBasicAuth(REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET)
+        data = {
+            "grant_type": "password",
+            "username": REDDIT_USERNAME,
+            "password": REDDIT_PASSWORD
+        }
+        headers = {"User-Agent": REDDIT_USER_AGENT}
+
+        try:
+            res = self.session.post("https://www.reddit.com/api/v1/access_token", auth=auth, data=data, headers=headers)
+            res.raise_for_status()
+            body = res.json()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Authentication failed: {e}")
+            raise
+        if "access_token" not in body:
+            # Bad credentials come back as a 200 with an error body
+            raise requests.exceptions.RequestException(f"Authentication failed: {body.get('error', body)}")
+
+        self.access_token = body["access_token"]
+        self.expires_at = time.time() + body.get("expires_in", 3600)
+        logger.info("Authenticated with Reddit API")
+
+    def read_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_cache(self):
+        # Written to a private temp file and renamed, so readers never see half a token
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.cache_path) or ".")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"access_token": self.access_token, "expires_at": self.expires_at}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def file_lock(self):
+        return CacheLock(self.cache_path + ".lock")
+
+
+class CacheLock:
+    """Exclusive flock on a lock file next to the token cache."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        if fcntl:
+            self.file = open(self.path, "a")
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.file:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
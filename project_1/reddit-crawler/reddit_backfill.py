@@ -0,0 +1,157 @@
+# Historical backfill: pages subreddits' /new listings backward to a target date,
+# one checkpointed work unit per subreddit, below the live crawl's priority
+
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import reddit_crawler
+from reddit_client import PRIORITY_BACKFILL, SharedRateLimitScheduler
+from reddit_crawler import (
+    MAX_CONCURRENCY,
+    crawl_post_comments,
+    dedupe_subreddits,
+    ensure_schema,
+    ensure_score_history_partitions,
+    execute_with_retry,
+    fetch_with_backoff,
+    get_spool,
+    insert_reddit_posts,
+    posts_needing_comments,
+    spool_listing,
+)
+
+# Logger setup
+logger = logging.getLogger("reddit_backfill")
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+
+def get_backfill_checkpoint(subreddit):
+    """Return (backfill_until, backfill_after, backfill_done_at) for a subreddit, or None if it has no row"""
+    query = """
+        SELECT backfill_until, backfill_after, backfill_done_at
+        FROM reddit_crawling_state
+        WHERE subreddit = %s
+    """
+    result = execute_with_retry(query, (subreddit,))
+    return result[0] if result else None
+
+
+def save_backfill_checkpoint(subreddit, until, after, reached, done):
+    """Record how far a subreddit's backfill has paged; the live crawl watermark is left alone"""
+    query = """
+        INSERT INTO reddit_crawling_state (subreddit, backfill_until, backfill_after, backfill_reached, backfill_done_at)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (subreddit) DO UPDATE
+        SET backfill_until = EXCLUDED.backfill_until,
+            backfill_after = EXCLUDED.backfill_after,
+            backfill_reached = EXCLUDED.backfill_reached,
+            backfill_done_at = EXCLUDED.backfill_done_at
+    """
+    done_at = datetime.now(timezone.utc) if done else None
+    execute_with_retry(query, (subreddit, until, after, reached, done_at))
+
+
+def store_backfill_page(posts, subreddit, with_comments=True):
+    """Store one backfilled page of posts and, optionally, the comments not fetched yet; False on failure."""
+    if get_spool():
+        spool_listing(posts, subreddit, kind="backfill")
+    elif insert_reddit_posts(posts, subreddit) is None:
+        return False
+    if with_comments:
+        due, _ = posts_needing_comments(posts)
+        for post in due:
+            crawl_post_comments(post, subreddit, PRIORITY_BACKFILL)
+    return True
+
+
+def backfill_subreddit(subreddit, until, limit=100, with_comments=True):
+    """
+    Page r/<subreddit>/new backward from the newest post, or from the checkpointed cursor
+    of an interrupted backfill to the same date, until a post older than `until` or the
+    end of the listing. The cursor is checkpointed after every stored page. Returns
+    "done", "skipped" (already backfilled to `until`) or "failed" (resumable).
+    """
+    checkpoint = get_backfill_checkpoint(subreddit)
+    after = None
+    if checkpoint and checkpoint[0] == until:
+        if checkpoint[2]:
+            logger.info(f"r/{subreddit} is already backfilled to {until}")
+            return "skipped"
+        after = checkpoint[1]
+        if after:
+            logger.info(f"Resuming backfill of r/{subreddit} from {after}")
+
+    pages = 0
+    while True:
+        # A long backfill can run into a month with no partition yet
+        ensure_score_history_partitions()
+        posts_data = fetch_with_backoff(reddit_crawler.reddit_client.fetch_subreddit_posts, subreddit,
+                                        limit=limit, after=after, priority=PRIORITY_BACKFILL)
+        if not posts_data:
+            logger.error(f"Backfill of r/{subreddit} stopped at {after}; run again to resume")
+            return "failed"
+
+        children = posts_data["data"]["children"]
+        posts = [post for post in children
+                 if datetime.fromtimestamp(post["data"]["created_utc"], tz=timezone.utc) >= until]
+        if posts and not store_backfill_page(posts, subreddit, with_comments):
+            logger.error(f"Backfill of r/{subreddit} stopped at {after}; run again to resume")
+            return "failed"
+        pages += 1
+
+        reached = min((datetime.fromtimestamp(post["data"]["created_utc"], tz=timezone.utc) for post in children),
+                      default=None)
+        after = posts_data["data"].get("after")
+        done = len(posts) < len(children) or not after
+        save_backfill_checkpoint(subreddit, until, after, reached, done)
+        if done:
+            break
+
+    if reached is None or reached >= until:
+        # /new only reaches back about 1000 posts
+        logger.warning(f"Listing of r/{subreddit} ended at {reached} before reaching {until}")
+    logger.info(f"Backfilled r/{subreddit} to {until} in {pages} pages")
+    return "done"
+
+
+def backfill(subreddits, until, concurrency=1, with_comments=True):
+    """Backfill each subreddit as an independent work unit, `concurrency` at a time; returns {status: count}."""
+    results = {"done": 0, "skipped": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=min(concurrency, MAX_CONCURRENCY)) as executor:
+        futures = {executor.submit(backfill_subreddit, subreddit, until, with_comments=with_comments): subreddit
+                   for subreddit in dedupe_subreddits(subreddits)}
+        for future in as_completed(futures):
+            try:
+                results[future.result()] += 1
+            except Exception as e:
+                logger.error(f"Error backfilling r/{futures[future]}: {e}")
+                results["failed"] += 1
+    logger.info(f"Backfill finished: {results['done']} done, {results['skipped']} already done, "
+                f"{results['failed']} failed")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill Reddit posts back to a date")
+    parser.add_argument("subreddits", nargs="+")
+    parser.add_argument("--until", required=True, type=datetime.fromisoformat,
+                        help="oldest post time to backfill to, e.g. 2024-01-01 (UTC unless an offset is given)")
+    parser.add_argument("--concurrency", type=int, default=3,
+                        help=f"subreddits backfilled at once (at most {MAX_CONCURRENCY})")
+    parser.add_argument("--no-comments", action="store_true", help="store the posts only")
+    args = parser.parse_args()
+    if not 1 <= args.concurrency <= MAX_CONCURRENCY:
+        parser.error(f"--concurrency must be between 1 and {MAX_CONCURRENCY}")
+    until = args.until if args.until.tzinfo else args.until.replace(tzinfo=timezone.utc)
+
+    # Share the rate limit window with the Faktory workers on this machine
+    reddit_crawler.reddit_client.rate_limiter = SharedRateLimitScheduler()
+    ensure_schema()
+    results = backfill(args.subreddits, until, args.concurrency, with_comments=not args.no_comments)
+    raise SystemExit(1 if results["failed"] else 0)
@@ -1,15 +1,24 @@
 import requests
 import os
+import heapq
+import itertools
+import json
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 from dotenv import load_dotenv
 import logging
+from http_session import get_session
+from reddit_auth import REDDIT_CLIENT_ID, CacheLock, TokenManager
 
 # Load environment variables
 load_dotenv()
-REDDIT_CLIENT_ID = os.getenv("REDDIT_CLIENT_ID")
-REDDIT_CLIENT_SECRET = os.getenv("REDDIT_CLIENT_SECRET")
 REDDIT_USER_AGENT = os.getenv("REDDIT_USER_AGENT")
-REDDIT_USERNAME = os.getenv("REDDIT_USERNAME")
-REDDIT_PASSWORD = os.getenv("REDDIT_PASSWORD")
+# Where worker processes on this machine share the rate limit window
+REDDIT_RATELIMIT_STATE = os.getenv("REDDIT_RATELIMIT_STATE") or os.path.join(
+    tempfile.gettempdir(), f"reddit_ratelimit_{REDDIT_CLIENT_ID}.json"
+)
 
 # Logger setup
 logger = logging.getLogger("reddit_client")
@@ -19,60 +28,251 @@ formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(messag
 sh.setFormatter(formatter)
 logger.addHandler(sh)
 
+# Request priorities, most urgent first
+PRIORITY_LISTING = 0
+PRIORITY_COMMENTS = 1
+PRIORITY_REFRESH = 2
+PRIORITY_BACKFILL = 3
+
+
+def is_rate_limited(error):
+    """Whether a requests exception is a 429 response."""
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code == 429
+
+
+class RateLimitScheduler:
+    """
+    Paces requests with the X-Ratelimit-Remaining/-Reset/-Used headers Reddit returns
+    on every response, spreading the remaining requests evenly over what is left of
+    the window instead of running flat out into a 429. Waiting callers go in
+    priority order, and requests below PRIORITY_LISTING leave `listing_reserve` of
+    each window's requests for listings. Backfill requests leave `backfill_reserve`
+    for the live crawl, which also holds between processes sharing the window.
+    """
+
+    clock = time.monotonic
+
+    def __init__(self, listing_reserve=0.1, backfill_reserve=0.5):
+        self.listing_reserve = listing_reserve
+        self.backfill_reserve = backfill_reserve
+        self.condition = threading.Condition()
+        self.remaining = None  # unknown until the first response of a window
+        self.limit = None
+        self.reset_at = None
+        self.next_slot = 0.0
+        self.waiting = []  # heap of (priority, sequence) tickets
+        self.sequence = itertools.count()
+
+    def wait(self, priority=PRIORITY_LISTING):
+        """Block until this caller may send a request."""
+        ticket = (priority, next(self.sequence))
+        with self.condition:
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    delay = None
+                    if self.waiting[0] == ticket:
+                        with self.shared_state():
+                            now = self.clock()
+                            if self.reset_at is not None and now >= self.reset_at:
+                                # New window; its budget is learned from the next response
+                                self.remaining = None
+                                self.reset_at = None
+                            delay = self.delay(priority, now)
+                            if delay <= 0:
+                                if self.remaining is not None:
+                                    self.next_slot = now + (self.reset_at - now) / max(self.remaining, 1)
+                                    self.remaining -= 1
+                                break
+                    self.condition.wait(delay)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+    def delay(self, priority, now):
+        """Seconds until a request of `priority` may go, with the budget as currently known."""
+        if self.remaining is None:
+            return self.next_slot - now
+        budget = self.remaining
+        if priority > PRIORITY_LISTING and self.limit:
+            reserve = self.backfill_reserve if priority >= PRIORITY_BACKFILL else self.listing_reserve
+            budget -= reserve * self.limit
+        if budget < 1:
+            return self.reset_at - now
+        return self.next_slot - now
+
+    def update(self, headers):
+        """Resynchronise with the rate limit headers of a response."""
+        remaining = headers.get("X-Ratelimit-Remaining")
+        reset = headers.get("X-Ratelimit-Reset")
+        if remaining is None or reset is None:
+            return
+        with self.condition, self.shared_state():
+            self.remaining = float(remaining)
+            self.reset_at = self.clock() + float(reset)
+            self.limit = self.remaining + float(headers.get("X-Ratelimit-Used", 0))
+            self.condition.notify_all()
+
+    def throttled(self, response):
+        """
+        Hold every request until the window resets after a 429. Returns False if the
+        response says nothing about when that is, leaving the caller to back off.
+        """
+        reset = response.headers.get("X-Ratelimit-Reset") or response.headers.get("Retry-After")
+        if reset is None:
+            return False
+        with self.condition, self.shared_state():
+            self.remaining = 0
+            self.reset_at = self.clock() + float(reset)
+            self.condition.notify_all()
+        return True
+
+    def time_until_reset(self):
+        with self.condition, self.shared_state():
+            if self.reset_at is None:
+                return 0.0
+            return max(0.0, self.reset_at - self.clock())
+
+    def shared_state(self):
+        """Hook around every read-modify-write of the window; the state is this process's own."""
+        return nullcontext()
+
+
+class SharedRateLimitScheduler(RateLimitScheduler):
+    """
+    A RateLimitScheduler whose window (remaining, reset time, next free slot) lives in
+    `state_path` under a file lock, so every worker process on the machine draws on one
+    budget, as they share one token. Priorities are still ordered within a process.
+    """
+
+    clock = time.time  # comparable across processes, unlike the monotonic clock
+
+    def __init__(self, state_path=REDDIT_RATELIMIT_STATE, listing_reserve=0.1, backfill_reserve=0.5):
+        super().__init__(listing_reserve, backfill_reserve)
+        self.state_path = state_path
+
+    @contextmanager
+    def shared_state(self):
+        with CacheLock(self.state_path + ".lock"):
+            try:
+                with open(self.state_path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+            self.remaining = state.get("remaining")
+            self.reset_at = state.get("reset_at")
+            self.limit = state.get("limit")
+            self.next_slot = state.get("next_slot", 0.0)
+            try:
+                yield
+            finally:
+                self.write_state()
+
+    def write_state(self):
+        # Written to a private temp file and renamed, like the token cache, so a symlink
+        # planted at the predictable path in the shared temp dir is replaced, not followed
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.state_path) or ".")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"remaining": self.remaining, "reset_at": self.reset_at,
+                       "limit": self.limit, "next_slot": self.next_slot}, f)
+        os.replace(tmp_path, self.state_path)
+
+
 class RedditClient:
-    def __init__(self):
-        self.token = None
+    def __init__(self, session=None):
+        # Keep-alive session; pass one in to share a pool or to stub http in tests
+        self.session = session or get_session()
+        self.rate_limiter = RateLimitScheduler()
+        # Token shared with the other workers on this machine
+        self.tokens = TokenManager(self.session)
         self.authenticate()
 
     def authenticate(self):
-        """Authenticate with Reddit API and retrieve access token."""
-        auth = requests.auth.HTTPBasicAuth(REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET)
-        data = {
-            "grant_type": "password",
-            "username": REDDIT_USERNAME,
-            "password": REDDIT_PASSWORD
-        }
-        headers = {"User-Agent": REDDIT_USER_AGENT}
-
-        try:
-            res = requests.post("https://www.reddit.com/api/v1/access_token", auth=auth, data=data, headers=headers)
-            res.raise_for_status()
-            self.token = res.json().get("access_token")
-            logger.info("Authenticated with Reddit API")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Authentication failed: {e}")
-            raise
+        """Make sure there is a valid access token, reusing the shared one while it lasts."""
+        self.tokens.token()
 
     def get_headers(self):
         """Return the authorization headers with the access token."""
-        if not self.token:
-            self.authenticate()
-        return {"Authorization": f"bearer {self.token}", "User-Agent": REDDIT_USER_AGENT}
-
-    def fetch_subreddit_posts(self, subreddit, limit=10):
-        """Fetch latest posts from a subreddit."""
-        headers = self.get_headers()
-        url = f"https://oauth.reddit.com/r/{subreddit}/new?limit={limit}"
-        try:
-            response = requests.get(url, headers=headers)
+        return {"Authorization": f"bearer {self.tokens.token()}", "User-Agent": REDDIT_USER_AGENT}
+
+    def request(self, url, priority, **kwargs):
+        """
+        GET an oauth.reddit.com url once the rate limit scheduler allows it. A 401
+        means the token was revoked or expired early, so it is replaced and the
+        request retried once.
+        """
+        for attempt in range(2):
+            token = self.tokens.token()
+            headers = {"Authorization": f"bearer {token}", "User-Agent": REDDIT_USER_AGENT}
+            self.rate_limiter.wait(priority)
+            response = self.session.get(url, headers=headers, **kwargs)
+            self.rate_limiter.update(response.headers)
+            if response.status_code == 401 and attempt == 0:
+                logger.warning("Access token rejected, re-authenticating")
+                self.tokens.invalidate(token)
+                continue
+            if response.status_code == 429:
+                self.rate_limiter.throttled(response)
             response.raise_for_status()
+            return response
+
+    def fetch_subreddit_posts(self, subreddit, limit=10, after=None, before=None, priority=PRIORITY_LISTING):
+        """Fetch latest posts from a subreddit, optionally paging from the `after`/`before` fullname."""
+        url = f"https://oauth.reddit.com/r/{subreddit}/new"
+        params = {"limit": limit}
+        if after:
+            params["after"] = after
+        if before:
+            params["before"] = before
+        try:
+            response = self.request(url, priority, params=params)
             logger.info(f"Fetched {limit} posts from subreddit: {subreddit}")
             return response.json()
         except requests.exceptions.RequestException as e:
+            if is_rate_limited(e):
+                raise
             logger.error(f"Failed to fetch posts from {subreddit}: {e}")
-            self.authenticate()  # Re-authenticate if token is expired
             return None
 
-    def fetch_post_comments(self, post_id):
-        """Fetch comments for a specific post."""
-        headers = self.get_headers()
+    def fetch_post_comments(self, post_id, priority=PRIORITY_COMMENTS, comment=None):
+        """Fetch comments for a specific post, or only the subtree under `comment`."""
         url = f"https://oauth.reddit.com/comments/{post_id}"
+        params = {"comment": comment} if comment else None
         try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
+            response = self.request(url, priority, params=params)
             logger.info(f"Fetched comments for post ID: {post_id}")
             return response.json()
         except requests.exceptions.RequestException as e:
+            if is_rate_limited(e):
+                raise
             logger.error(f"Failed to fetch comments for post {post_id}: {e}")
-            self.authenticate()  # Re-authenticate if token is expired
+            return None
+
+    def fetch_info(self, fullnames, priority=PRIORITY_REFRESH):
+        """Fetch current data for up to 100 things (e.g. t3_ post fullnames) in one request."""
+        url = "https://oauth.reddit.com/api/info"
+        try:
+            response = self.request(url, priority, params={"id": ",".join(fullnames)})
+            logger.info(f"Fetched info for {len(fullnames)} things")
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            if is_rate_limited(e):
+                raise
+            logger.error(f"Failed to fetch info for {len(fullnames)} things: {e}")
+            return None
+
+    def fetch_more_children(self, post_id, children, priority=PRIORITY_COMMENTS):
+        """Expand up to 100 comment ids from a post's "more" stubs; returns the flat list of things."""
+        url = "https://oauth.reddit.com/api/morechildren"
+        params = {"api_type": "json", "link_id": f"t3_{post_id}", "children": ",".join(children)}
+        try:
+            response = self.request(url, priority, params=params)
+            logger.info(f"Fetched {len(children)} more comments for post ID: {post_id}")
+            return response.json()["json"]["data"]["things"]
+        except requests.exceptions.RequestException as e:
+            if is_rate_limited(e):
+                raise
+            logger.error(f"Failed to fetch more comments for post {post_id}: {e}")
             return None
@@ -1,10 +1,17 @@
-from reddit_client import RedditClient
+from comment_tree import CommentTree
+from reddit_client import PRIORITY_COMMENTS, PRIORITY_REFRESH, RedditClient
+from refresh_schedule import FIRST_REFRESH, REFRESH_CUTOFF, next_refresh_at
+from score_history import create_score_history, ensure_partitions, month_start, next_month
+from spool import Spool
 import logging
 import psycopg2
 from psycopg2.extras import Json, execute_values
 from datetime import datetime, timezone
 import time
 import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from requests.exceptions import HTTPError
 from dotenv import load_dotenv
 from psycopg2 import pool
@@ -20,13 +27,27 @@ logger.addHandler(sh)
 # Load environment variables
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+# When set, fetched listings and comments are appended to a local spool for
+# reddit_spool_loader.py instead of being written to Postgres
+SPOOL_DIR = os.getenv("SPOOL_DIR")
 
-# Connection pool
-connection_pool = psycopg2.pool.SimpleConnectionPool(1, 10, dsn=DATABASE_URL)
+# Most worker threads crawling at once; each holds at most one pooled connection
+MAX_CONCURRENCY = 10
+
+# Connection pool, shared by the crawl threads
+connection_pool = psycopg2.pool.ThreadedConnectionPool(1, MAX_CONCURRENCY, dsn=DATABASE_URL)
 
 # Initialize Reddit client
 reddit_client = RedditClient()
 
+# Spool, opened on first use in each process so forked Faktory job processes each
+# write their own segments
+spool = None
+spool_pid = None
+
+# Month ensure_score_history_partitions last covered in this process
+score_history_month = None
+
 
 def get_connection_from_pool():
     """Fetch a connection from the pool."""
@@ -43,6 +64,35 @@ def release_connection(conn):
         connection_pool.putconn(conn)
 
 
+def get_spool():
+    """Return this process's spool, or None when not spooling"""
+    global spool, spool_pid
+    if not SPOOL_DIR:
+        return None
+    if spool is None or spool_pid != os.getpid():
+        spool = Spool(SPOOL_DIR, "reddit")
+        spool_pid = os.getpid()
+    return spool
+
+
+@contextmanager
+def unit_of_work():
+    """Run a block on one pooled connection in one transaction: committed if it succeeds, rolled back if it raises."""
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+    try:
+        yield cur
+        conn.commit()
+    except Exception:
+        # A connection the server dropped can't roll back; keep the original error for the caller's retry
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
 def fetch_with_backoff(reddit_client_func, *args, **kwargs):
     """Fetch data with backoff strategy in case of rate limiting."""
     backoff_time = 1  # Start with 1 second backoff
@@ -53,6 +103,11 @@ def fetch_with_backoff(reddit_client_func, *args, **kwargs):
             return reddit_client_func(*args, **kwargs)
         except HTTPError as e:
             if e.response.status_code == 429:
+                wait_time = reddit_client.rate_limiter.time_until_reset()
+                if wait_time:
+                    # The client's scheduler holds the retry until the window resets
+                    logger.warning(f"Rate limit hit. Retrying when the window resets in {wait_time:.0f} seconds...")
+                    continue
                 logger.warning(f"Rate limit hit. Backing off for {backoff_time} seconds...")
                 time.sleep(backoff_time)
                 backoff_time = min(backoff_time * 2, max_backoff)  # Exponential backoff
@@ -66,32 +121,109 @@ def fetch_with_backoff(reddit_client_func, *args, **kwargs):
 
 def execute_with_retry(query, params=None, retries=3):
     """Execute a database query with retry logic."""
-    conn = get_connection_from_pool()
     for attempt in range(retries):
         try:
-            cur = conn.cursor()
-            cur.execute(query, params)
-            conn.commit()
-            return cur.fetchall() if cur.description else None
+            with unit_of_work() as cur:
+                cur.execute(query, params)
+                return cur.fetchall() if cur.description else None
         except psycopg2.OperationalError as e:
             logger.error(f"Database error on attempt {attempt + 1}: {e}")
             if attempt < retries - 1:
-                time.sleep(2 ** attempt)  # Exponential backoff
-                conn = get_connection_from_pool()  # Reconnect
+                time.sleep(2 ** attempt)  # Exponential backoff, then retry on a fresh connection
             else:
                 raise
-        finally:
-            cur.close()
-            release_connection(conn)
 
 
 # Database operations
+def ensure_schema():
+    """
+    Add the columns for comment tree structure, per-post comment watermarks, the refresh
+    schedule, worker job chains and backfill checkpoints, and score_history.
+    """
+    execute_with_retry("""
+        ALTER TABLE reddit_crawler_posts
+            ADD COLUMN IF NOT EXISTS num_comments INTEGER,
+            ADD COLUMN IF NOT EXISTS comments_fetched_count INTEGER,
+            ADD COLUMN IF NOT EXISTS comments_fetched_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS next_refresh_at TIMESTAMPTZ
+    """)
+    # Next run of each Faktory listing chain (see reddit_worker.py)
+    execute_with_retry("""
+        ALTER TABLE reddit_crawling_state
+            ADD COLUMN IF NOT EXISTS listing_scheduled_at TIMESTAMPTZ
+    """)
+    # Next run of the worker chains that aren't per subreddit, e.g. crawl-refresh
+    execute_with_retry("""
+        CREATE TABLE IF NOT EXISTS reddit_worker_schedule (
+            jobtype TEXT PRIMARY KEY,
+            scheduled_at TIMESTAMPTZ NOT NULL
+        )
+    """)
+    # Cursor of a historical backfill (see reddit_backfill.py), kept apart from the live watermark
+    execute_with_retry("""
+        ALTER TABLE reddit_crawling_state
+            ADD COLUMN IF NOT EXISTS backfill_until TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS backfill_after TEXT,
+            ADD COLUMN IF NOT EXISTS backfill_reached TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS backfill_done_at TIMESTAMPTZ
+    """)
+    execute_with_retry("""
+        ALTER TABLE reddit_crawler_comments
+            ADD COLUMN IF NOT EXISTS parent_id TEXT,
+            ADD COLUMN IF NOT EXISTS depth INTEGER,
+            ADD COLUMN IF NOT EXISTS last_checked TIMESTAMPTZ
+    """)
+    with unit_of_work() as cur:
+        create_score_history(cur)
+    ensure_score_history_partitions()
+    # Only scheduled posts are indexed, so the index stays small as old posts age out
+    execute_with_retry("""
+        CREATE INDEX IF NOT EXISTS reddit_crawler_posts_next_refresh_idx
+        ON reddit_crawler_posts (next_refresh_at)
+        WHERE next_refresh_at IS NOT NULL
+    """)
+
+
+def ensure_score_history_partitions():
+    """
+    Make sure score_history has partitions for this month and the next, so writes never
+    miss one. Cheap to call often: the database is only asked once per month per process.
+    """
+    global score_history_month
+    this_month = month_start(datetime.now(timezone.utc))
+    if score_history_month == this_month:
+        return
+    with unit_of_work() as cur:
+        ensure_partitions(cur, [this_month, next_month(this_month)])
+    score_history_month = this_month
+
+
 def get_last_crawled_time(subreddit):
     query = "SELECT last_crawled_utc FROM reddit_crawling_state WHERE subreddit = %s"
     result = execute_with_retry(query, (subreddit,))
     return result[0][0] if result else None
 
 
+def get_listing_watermark(listing):
+    """
+    Crawl watermark for a listing, a subreddit or a multireddit like "a+b+c": the newest
+    of its subreddits' watermarks, or None if none of them has one yet. Anything
+    submitted since the listing was last crawled is newer than all of them, so paging
+    can stop there without re-reading quiet subreddits' older posts. Members without a
+    watermark (quiet, new or nonexistent subreddits) are left out rather than keeping
+    the whole group on a single page.
+    """
+    members = [name.lower() for name in listing.split("+")]
+    query = """
+        SELECT lower(subreddit), last_crawled_utc
+        FROM reddit_crawling_state
+        WHERE lower(subreddit) = ANY(%s)
+    """
+    watermarks = [last_crawled for _, last_crawled in execute_with_retry(query, (members,)) or []
+                  if last_crawled is not None]
+    return max(watermarks, default=None)
+
+
 def update_last_crawled_time(subreddit, last_crawled_utc):
     query = """
         INSERT INTO reddit_crawling_state (subreddit, last_crawled_utc)
@@ -101,136 +233,558 @@ def update_last_crawled_time(subreddit, last_crawled_utc):
     execute_with_retry(query, (subreddit, last_crawled_utc))
 
 
-def create_placeholder_post(post_id, subreddit):
-    """Create a placeholder post if the post ID does not exist."""
-    placeholder_data = (
-        post_id, "[Placeholder Title]", "[Unknown]", datetime.now(timezone.utc), "",
-        0, subreddit, datetime.now()
-    )
+def get_comment_watermarks(post_ids):
+    """Return {post_id: num_comments when its comments were last fetched} for the given posts."""
+    if not post_ids:
+        return {}
     query = """
-        INSERT INTO reddit_crawler_posts (post_id, title, author, created_utc, content, score, subreddit, last_checked)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (post_id) DO NOTHING;
+        SELECT post_id, comments_fetched_count
+        FROM reddit_crawler_posts
+        WHERE post_id = ANY(%s) AND comments_fetched_count IS NOT NULL
     """
-    execute_with_retry(query, placeholder_data)
-    logger.info(f"Created placeholder post for post_id: {post_id}")
+    return dict(execute_with_retry(query, (list(post_ids),)))
 
 
-def insert_reddit_posts(posts, subreddit):
-    """Insert posts into the database."""
-    conn = get_connection_from_pool()
+def update_comment_watermark(post_id, num_comments, refresh_at=None):
+    """Record a comment fetch and when the post's comments are due again (None stops refreshing it)."""
+    query = """
+        UPDATE reddit_crawler_posts
+        SET comments_fetched_count = %s, comments_fetched_at = %s, next_refresh_at = %s
+        WHERE post_id = %s
+    """
+    execute_with_retry(query, (num_comments, datetime.now(timezone.utc), refresh_at, post_id))
+
+
+def reschedule_refresh(post_id, refresh_at):
+    query = "UPDATE reddit_crawler_posts SET next_refresh_at = %s WHERE post_id = %s"
+    execute_with_retry(query, (refresh_at, post_id))
+
+
+def get_posts_due_for_refresh(limit):
+    """Return (post_id, subreddit, created_utc, comments_fetched_count) of the most overdue posts."""
+    query = """
+        SELECT post_id, subreddit, created_utc, comments_fetched_count
+        FROM reddit_crawler_posts
+        WHERE next_refresh_at <= %s
+        ORDER BY next_refresh_at
+        LIMIT %s
+    """
+    return execute_with_retry(query, (datetime.now(timezone.utc), limit)) or []
+
+
+def update_post_metadata(posts):
+    """
+    Bulk-update score, num_comments and last_checked from post data, appending the
+    posts whose score or comment count changed to score_history. Returns the rows updated.
+    """
+    values = [
+        (post["data"]["id"], post["data"].get("score", 0), post["data"].get("num_comments"))
+        for post in posts
+    ]
+    # Every CTE sees the table as it was before the statement, so `previous` holds the old values
+    query = """
+        WITH incoming (post_id, score, num_comments) AS (
+            VALUES %s
+        ), previous AS (
+            SELECT p.post_id, p.score, p.num_comments
+            FROM reddit_crawler_posts p
+            JOIN incoming i ON i.post_id = p.post_id
+        ), updated AS (
+            UPDATE reddit_crawler_posts p
+            SET score = i.score, num_comments = i.num_comments, last_checked = now()
+            FROM incoming i
+            WHERE p.post_id = i.post_id
+            RETURNING p.post_id, p.score, p.num_comments
+        ), history AS (
+            INSERT INTO score_history (fullname, score, num_comments)
+            SELECT 't3_' || u.post_id, u.score, u.num_comments
+            FROM updated u
+            JOIN previous pr ON pr.post_id = u.post_id
+            WHERE (pr.score, pr.num_comments) IS DISTINCT FROM (u.score, u.num_comments)
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM updated), (SELECT COUNT(*) FROM history)
+    """
     try:
-        cur = conn.cursor()
-        newest_created_utc = None
-        post_values = []
-
-        for post in posts:
-            post_data = {
-                "id": post["data"]["id"],
-                "title": post["data"].get("title", "[No Title]"),
-                "author": post["data"].get("author", "[Unknown]"),
-                "created_utc": datetime.fromtimestamp(post["data"]["created_utc"], tz=timezone.utc),
-                "selftext": post["data"].get("selftext", ""),
-                "score": post["data"].get("score", 0),
-                "subreddit": subreddit
-            }
-            post_values.append((
-                post_data["id"], post_data["title"], post_data["author"], post_data["created_utc"],
-                post_data["selftext"], post_data["score"], post_data["subreddit"], datetime.now()
-            ))
-            if not newest_created_utc or post_data["created_utc"] > newest_created_utc:
-                newest_created_utc = post_data["created_utc"]
-
-        query = """
-            INSERT INTO reddit_crawler_posts (post_id, title, author, created_utc, content, score, subreddit, last_checked)
+        with unit_of_work() as cur:
+            updated, changed = execute_values(
+                cur, query, values, template="(%s, %s::integer, %s::integer)", page_size=len(values), fetch=True
+            )[0]
+    except Exception as e:
+        logger.error(f"Error updating post metadata: {e}")
+        return 0
+    logger.info(f"Updated metadata of {updated} posts, {changed} changed")
+    return updated
+
+
+def insert_reddit_posts(posts, subreddit):
+    """
+    Upsert posts, refreshing the score, comment count and last_checked of posts already
+    stored and appending new or changed ones to score_history. Returns the newest post time.
+    """
+    newest_created_utc = None
+    post_values = {}
+
+    now = datetime.now(timezone.utc)
+    for post in posts:
+        post_data = {
+            "id": post["data"]["id"],
+            "title": post["data"].get("title", "[No Title]"),
+            "author": post["data"].get("author", "[Unknown]"),
+            "created_utc": datetime.fromtimestamp(post["data"]["created_utc"], tz=timezone.utc),
+            "selftext": post["data"].get("selftext", ""),
+            "score": post["data"].get("score", 0),
+            "num_comments": post["data"].get("num_comments"),
+            "subreddit": subreddit
+        }
+        # Posts already past the refresh cutoff (e.g. backfilled ones) are never revisited
+        first_refresh = None
+        if now - post_data["created_utc"] < REFRESH_CUTOFF:
+            first_refresh = post_data["created_utc"] + FIRST_REFRESH
+        # Keyed by id: a post can show up on two pages if the listing shifted while paging
+        post_values[post_data["id"]] = (
+            post_data["id"], post_data["title"], post_data["author"], post_data["created_utc"],
+            post_data["selftext"], post_data["score"], post_data["num_comments"],
+            post_data["subreddit"], now, first_refresh
+        )
+        if not newest_created_utc or post_data["created_utc"] > newest_created_utc:
+            newest_created_utc = post_data["created_utc"]
+    if not post_values:
+        return None
+
+    query = """
+        WITH incoming (
+            post_id, title, author, created_utc, content, score, num_comments, subreddit, last_checked,
+            next_refresh_at
+        ) AS (
             VALUES %s
-            ON CONFLICT (post_id) DO NOTHING
-        """
-        execute_values(cur, query, post_values)
-        conn.commit()
-        logger.info(f"Inserted {len(post_values)} posts for subreddit {subreddit}")
-        return newest_created_utc
+        ), previous AS (
+            SELECT p.post_id, p.score, p.num_comments
+            FROM reddit_crawler_posts p
+            JOIN incoming i ON i.post_id = p.post_id
+        ), upserted AS (
+            INSERT INTO reddit_crawler_posts (
+                post_id, title, author, created_utc, content, score, num_comments, subreddit, last_checked,
+                next_refresh_at
+            )
+            SELECT * FROM incoming
+            ON CONFLICT (post_id) DO UPDATE
+            SET score = EXCLUDED.score, num_comments = EXCLUDED.num_comments, last_checked = EXCLUDED.last_checked
+            RETURNING post_id, score, num_comments
+        )
+        INSERT INTO score_history (fullname, score, num_comments)
+        SELECT 't3_' || u.post_id, u.score, u.num_comments
+        FROM upserted u
+        LEFT JOIN previous pr ON pr.post_id = u.post_id
+        WHERE pr.post_id IS NULL OR (pr.score, pr.num_comments) IS DISTINCT FROM (u.score, u.num_comments)
+    """
+    try:
+        with unit_of_work() as cur:
+            execute_values(
+                cur, query, list(post_values.values()),
+                template="(%s, %s, %s, %s::timestamptz, %s, %s::integer, %s::integer, %s, %s::timestamptz, %s::timestamptz)",
+                page_size=len(post_values)
+            )
     except Exception as e:
         logger.error(f"Error inserting posts: {e}")
-        conn.rollback()
-    finally:
-        cur.close()
-        release_connection(conn)
+        return None
+    logger.info(f"Upserted {len(post_values)} posts for subreddit {subreddit}")
+    return newest_created_utc
 
 
 def batch_insert_reddit_comments(comments, post_id, subreddit):
-    """Insert comments into the database."""
-    conn = get_connection_from_pool()
-    try:
-        cur = conn.cursor()
-
-        # Ensure post exists
-        query = "SELECT 1 FROM reddit_crawler_posts WHERE post_id = %s"
-        post_exists = execute_with_retry(query, (post_id,))
-        if not post_exists:
-            logger.warning(f"Post ID {post_id} not found. Creating placeholder...")
-            create_placeholder_post(post_id, subreddit)
-
-        # Insert comments
-        comment_values = []
-        for comment in comments:
-            if "data" not in comment or "created_utc" not in comment["data"]:
-                logger.warning(f"Skipping comment due to missing 'created_utc'")
-                continue
-
-            created_utc = datetime.fromtimestamp(comment["data"]["created_utc"], tz=timezone.utc)
-            comment_data = {
-                "id": comment["data"]["id"],
-                "post_id": post_id,
-                "author": comment["data"].get("author", "[Unknown]"),
-                "created_utc": created_utc,
-                "content": comment["data"].get("body"),
-                "score": comment["data"].get("score")
-            }
-            comment_values.append((
-                comment_data["id"], comment_data["post_id"], comment_data["author"],
-                comment_data["created_utc"], comment_data["content"], comment_data["score"]
-            ))
-
-        query = """
-            INSERT INTO reddit_crawler_comments (comment_id, post_id, author, created_utc, content, score)
+    """
+    Upsert comments, creating a placeholder post first if the post is missing and
+    appending new or re-scored comments to score_history. All of it happens in one
+    statement on one connection and one commit. Returns True once committed.
+    """
+    comment_values = []
+    for comment in comments:
+        if "data" not in comment or "created_utc" not in comment["data"]:
+            logger.warning(f"Skipping comment due to missing 'created_utc'")
+            continue
+
+        created_utc = datetime.fromtimestamp(comment["data"]["created_utc"], tz=timezone.utc)
+        comment_data = {
+            "id": comment["data"]["id"],
+            "post_id": post_id,
+            "author": comment["data"].get("author", "[Unknown]"),
+            "created_utc": created_utc,
+            "content": comment["data"].get("body"),
+            "score": comment["data"].get("score"),
+            "parent_id": comment["data"].get("parent_id"),
+            "depth": comment["data"].get("depth")
+        }
+        comment_values.append((
+            comment_data["id"], comment_data["post_id"], subreddit, comment_data["author"],
+            comment_data["created_utc"], comment_data["content"], comment_data["score"],
+            comment_data["parent_id"], comment_data["depth"]
+        ))
+    if not comment_values:
+        return True
+
+    # The placeholder row is visible to the comments' foreign key check, which runs at the end of the
+    # statement, and `previous` sees scores as they were before it
+    query = """
+        WITH incoming (comment_id, post_id, subreddit, author, created_utc, content, score, parent_id, depth) AS (
             VALUES %s
-            ON CONFLICT (comment_id) DO NOTHING
-        """
-        execute_values(cur, query, comment_values)
-        conn.commit()
-        logger.info(f"Inserted {len(comment_values)} comments for post ID {post_id}")
+        ), previous AS (
+            SELECT c.comment_id, c.score
+            FROM reddit_crawler_comments c
+            JOIN incoming i ON i.comment_id = c.comment_id
+        ), placeholder AS (
+            INSERT INTO reddit_crawler_posts (post_id, title, author, created_utc, content, score, subreddit, last_checked)
+            SELECT DISTINCT post_id, '[Placeholder Title]', '[Unknown]', now(), '', 0, subreddit, now()
+            FROM incoming
+            ON CONFLICT (post_id) DO NOTHING
+            RETURNING post_id
+        ), upserted AS (
+            INSERT INTO reddit_crawler_comments (
+                comment_id, post_id, author, created_utc, content, score, parent_id, depth, last_checked
+            )
+            SELECT comment_id, post_id, author, created_utc, content, score, parent_id, depth, now()
+            FROM incoming
+            ON CONFLICT (comment_id) DO UPDATE
+            SET score = EXCLUDED.score, last_checked = EXCLUDED.last_checked
+            RETURNING comment_id, score, (xmax = 0) AS inserted
+        ), history AS (
+            INSERT INTO score_history (fullname, score)
+            SELECT 't1_' || u.comment_id, u.score
+            FROM upserted u
+            LEFT JOIN previous pr ON pr.comment_id = u.comment_id
+            WHERE pr.comment_id IS NULL OR pr.score IS DISTINCT FROM u.score
+            RETURNING 1
+        )
+        SELECT
+            (SELECT COUNT(*) FROM placeholder),
+            (SELECT COUNT(*) FROM upserted WHERE inserted),
+            (SELECT COUNT(*) FROM history)
+    """
+    try:
+        with unit_of_work() as cur:
+            placeholders, inserted, changed = execute_values(
+                cur, query, comment_values,
+                template="(%s, %s, %s, %s, %s::timestamptz, %s, %s::integer, %s, %s::integer)",
+                page_size=len(comment_values), fetch=True
+            )[0]
     except Exception as e:
         logger.error(f"Error inserting comments: {e}")
-        conn.rollback()
-    finally:
-        cur.close()
-        release_connection(conn)
+        return False
+
+    if placeholders:
+        logger.warning(f"Post ID {post_id} not found. Created placeholder")
+    logger.info(f"Upserted {len(comment_values)} comments for post ID {post_id}: "
+                f"{inserted} new, {changed} with a new score")
+    return True
+
+
+def expand_comment_tree(post_id, listing, priority=PRIORITY_COMMENTS, max_continuations=20):
+    """
+    Flatten a post's comment listing into all of its comments, each with its parent_id
+    and depth. Hidden replies behind "more" stubs are expanded through /api/morechildren,
+    100 ids per request, and up to `max_continuations` "continue this thread" subtrees
+    are fetched on their own.
+    """
+    tree = CommentTree()
+    tree.add_listing(listing)
+    followed = 0
+    while True:
+        for batch in tree.pending_batches():
+            things = fetch_with_backoff(reddit_client.fetch_more_children, post_id, batch, priority=priority)
+            if things:
+                tree.add_things(things)
+        if not tree.continuations or followed >= max_continuations:
+            break
+        comment_id, depth = tree.continuations.pop()
+        followed += 1
+        # The subtree's root is the comment the stub hangs off, one level above the stub
+        subtree = fetch_with_backoff(reddit_client.fetch_post_comments, post_id, priority=priority, comment=comment_id)
+        if subtree:
+            tree.add_listing(subtree[1]["data"]["children"], base_depth=depth - 1)
+
+    if tree.continuations:
+        logger.warning(f"Left {len(tree.continuations)} deep threads of post {post_id} unexpanded")
+    return tree.comments
+
+
+def spool_listing(posts, subreddit, kind="listing"):
+    """Append fetched posts to the spool, wrapped like a listing; backfilled pages are spooled as kind "backfill"."""
+    get_spool().append({
+        "kind": kind, "subreddit": subreddit, "fetched_at": time.time(),
+        "data": {"data": {"children": posts}}
+    })
+
+
+def spool_comments(comments, post_id, subreddit, num_comments=None):
+    """Append a post's fetched comments, and the listing's comment count they match, to the spool."""
+    get_spool().append({
+        "kind": "comments", "subreddit": subreddit, "post_id": post_id,
+        "num_comments": num_comments, "fetched_at": time.time(), "data": comments
+    })
+
+
+def fetch_new_posts(subreddit, limit=100, max_pages=10):
+    """
+    Fetch the posts submitted since the stored watermark of a subreddit (or of every
+    subreddit in an "a+b+c" multireddit), newest first.
+    Pages through /new with `after` until a page reaches a post at or before the
+    watermark. Without a watermark (first crawl, or the database is unreachable)
+    only the newest page is fetched. Already-seen posts on the last page are
+    returned too, since their comment counts come for free.
+    """
+    try:
+        watermark = get_listing_watermark(subreddit)
+    except Exception as e:
+        logger.error(f"Could not read crawl watermark for {subreddit}: {e}")
+        watermark = None
+
+    posts = []
+    after = None
+    for _ in range(max_pages if watermark else 1):
+        posts_data = fetch_with_backoff(reddit_client.fetch_subreddit_posts, subreddit, limit=limit, after=after)
+        if not posts_data:
+            break
+
+        children = posts_data["data"]["children"]
+        reached_watermark = False
+        for post in children:
+            created_utc = datetime.fromtimestamp(post["data"]["created_utc"], tz=timezone.utc)
+            if watermark and created_utc <= watermark:
+                reached_watermark = True
+            posts.append(post)
+
+        after = posts_data["data"].get("after")
+        if reached_watermark or not after:
+            break
+    else:
+        if watermark:
+            logger.warning(f"Stopped paging {subreddit} after {max_pages} pages without reaching the watermark")
+
+    logger.info(f"Listed {len(posts)} posts in subreddit {subreddit}")
+    return posts
+
+
+def dedupe_subreddits(subreddits):
+    """Drop repeated subreddits, ignoring case as Reddit does, keeping the first spelling."""
+    unique = {}
+    for name in subreddits:
+        unique.setdefault(name.lower(), name)
+    return list(unique.values())
 
 
-def crawl_reddit(subreddits, limit=100, delay=120, comment_update_interval=3600):
-    """Main function to crawl posts and periodically update comments on old posts."""
+def group_subreddits(subreddits, group_size):
+    """Combine subreddits into multireddit listings of up to `group_size`, e.g. "a+b+c"."""
+    return ["+".join(subreddits[i:i + group_size]) for i in range(0, len(subreddits), group_size)]
+
+
+def posts_by_subreddit(posts, listing):
+    """Split a listing's posts by the subreddit each was posted in, spelled as in the listing."""
+    names = {name.lower(): name for name in listing.split("+")}
+    grouped = {}
+    for post in posts:
+        subreddit = post["data"].get("subreddit", listing)
+        grouped.setdefault(names.get(subreddit.lower(), subreddit), []).append(post)
+    return grouped
+
+
+def posts_needing_comments(posts):
+    """
+    Split listed posts into those whose comment count changed since their comments
+    were last fetched and those that can be skipped. If the watermarks can't be
+    read every post is fetched.
+    """
+    try:
+        watermarks = get_comment_watermarks([post["data"]["id"] for post in posts])
+    except Exception as e:
+        logger.error(f"Could not read comment watermarks: {e}")
+        watermarks = {}
+
+    due, skipped = [], []
+    for post in posts:
+        post_id = post["data"]["id"]
+        if post_id in watermarks and watermarks[post_id] == post["data"].get("num_comments"):
+            skipped.append(post)
+        else:
+            due.append(post)
+    return due, skipped
+
+
+def refresh_post_metadata(post_ids, batch_size=100):
+    """
+    Refresh score, num_comments and last_checked of stored posts through /api/info,
+    up to 100 posts per request. Returns {post_id: num_comments} for the posts Reddit returned.
+    """
+    post_ids = list(post_ids)
+    counts = {}
+    for start in range(0, len(post_ids), batch_size):
+        fullnames = [f"t3_{post_id}" for post_id in post_ids[start:start + batch_size]]
+        info = fetch_with_backoff(reddit_client.fetch_info, fullnames, priority=PRIORITY_REFRESH)
+        if not info:
+            continue
+        posts = [child for child in info["data"]["children"] if child.get("kind") == "t3"]
+        if posts and update_post_metadata(posts):
+            counts.update((post["data"]["id"], post["data"].get("num_comments")) for post in posts)
+    return counts
+
+
+def refresh_post(post_id, subreddit, created_utc, fetched_count, current_count, priority=PRIORITY_REFRESH):
+    """
+    Revisit one post that is due: reschedule it if its comment count has not moved,
+    otherwise re-fetch its comments. Returns "unchanged", "refreshed" or None on failure.
+    """
+    if current_count is not None and current_count == fetched_count:
+        try:
+            reschedule_refresh(post_id, next_refresh_at(created_utc, active=False))
+            return "unchanged"
+        except Exception as e:
+            logger.error(f"Could not reschedule post {post_id}: {e}")
+            return None
+
+    comments_data = fetch_with_backoff(reddit_client.fetch_post_comments, post_id, priority=priority)
+    if not comments_data:
+        return None
+
+    # The first listing of a comments response is the post itself, with its current count
+    post_listing = comments_data[0]["data"]["children"]
+    num_comments = post_listing[0]["data"].get("num_comments") if post_listing else None
+    active = num_comments != fetched_count
+    comments = expand_comment_tree(post_id, comments_data[1]["data"]["children"], priority)
+    if get_spool():
+        spool_comments(comments, post_id, subreddit, num_comments)
+    elif not batch_insert_reddit_comments(comments, post_id, subreddit):
+        return None
+
+    try:
+        update_comment_watermark(post_id, num_comments, next_refresh_at(created_utc, active))
+    except Exception as e:
+        logger.error(f"Could not reschedule post {post_id}: {e}")
+        return None
+    return "refreshed"
+
+
+def refresh_old_posts(batch_size=200, executor=None):
+    """
+    Refresh posts whose next_refresh_at has passed, most overdue first. Scores and
+    comment counts are refreshed in bulk through /api/info; comments are only
+    re-fetched for posts whose count moved, and every post is rescheduled on its
+    age tier; posts whose revisit fails are pushed back as if unchanged. Posts are
+    revisited on `executor` when one is given. Returns the number of posts whose
+    comments were re-fetched.
+    """
+    try:
+        due = get_posts_due_for_refresh(batch_size)
+    except Exception as e:
+        logger.error(f"Could not read posts due for refresh: {e}")
+        return 0
+
+    current_counts = refresh_post_metadata(post_id for post_id, _, _, _ in due)
+    jobs = [(*row, current_counts.get(row[0])) for row in due]
+    results = executor.map(lambda job: refresh_post(*job), jobs) if executor else [refresh_post(*job) for job in jobs]
+    results = list(results)
+    for (post_id, _, created_utc, _, _), result in zip(jobs, results):
+        if result is None:
+            # Push failed posts back a tier so they can't hold the head of the queue
+            try:
+                reschedule_refresh(post_id, next_refresh_at(created_utc, active=False))
+            except Exception as e:
+                logger.error(f"Could not reschedule post {post_id}: {e}")
+    refreshed = results.count("refreshed")
+    unchanged = results.count("unchanged")
+
+    if due:
+        logger.info(f"Refreshed comments of {refreshed} of {len(due)} posts due, "
+                    f"{unchanged} unchanged since their last fetch")
+    return refreshed
+
+
+def store_subreddit_posts(posts, subreddit):
+    """Store one subreddit's listed posts; returns (posts with new comments, posts skipped)."""
+    if get_spool():
+        # The loader inserts the posts and moves the crawl watermark
+        spool_listing(posts, subreddit)
+    else:
+        new_last_crawled_utc = insert_reddit_posts(posts, subreddit)
+        if new_last_crawled_utc:
+            update_last_crawled_time(subreddit, new_last_crawled_utc)
+    return posts_needing_comments(posts)
+
+
+def crawl_listing(listing, limit=100):
+    """Fetch and store a listing's new posts; returns ([(post, subreddit) needing comments], skipped count)."""
+    logger.info(f"Fetching new posts from subreddit: {listing}")
+    posts = fetch_new_posts(listing, limit=limit)
+
+    due, skipped = [], 0
+    for subreddit, subreddit_posts in posts_by_subreddit(posts, listing).items():
+        subreddit_due, subreddit_skipped = store_subreddit_posts(subreddit_posts, subreddit)
+        due.extend((post, subreddit) for post in subreddit_due)
+        skipped += len(subreddit_skipped)
+    return due, skipped
+
+
+def crawl_post_comments(post, subreddit, priority=PRIORITY_COMMENTS):
+    """Fetch and store the comments of a listed post and move its comment watermark."""
+    post_id = post["data"]["id"]
+    num_comments = post["data"].get("num_comments")
+    created_utc = datetime.fromtimestamp(post["data"]["created_utc"], tz=timezone.utc)
+    comments_data = fetch_with_backoff(reddit_client.fetch_post_comments, post_id, priority=priority)
+    if comments_data:
+        comments = expand_comment_tree(post_id, comments_data[1]["data"]["children"], priority)
+        if get_spool():
+            spool_comments(comments, post_id, subreddit, num_comments)
+        elif batch_insert_reddit_comments(comments, post_id, subreddit):
+            update_comment_watermark(post_id, num_comments, next_refresh_at(created_utc))
+
+
+def crawl_reddit(subreddits, limit=100, delay=120, comment_update_interval=300, multireddit_size=None,
+                 concurrency=1):
+    """
+    Main function to crawl posts and periodically update comments on old posts.
+    With `multireddit_size`, subreddits are fetched in combined r/a+b+c/new listings
+    of that many subreddits each. Listing and comment fetches run on `concurrency`
+    threads; the client's rate limiter paces them all, so a slow response holds up
+    one thread rather than the whole cycle.
+    """
+    subreddits = dedupe_subreddits(subreddits)
+    listings = group_subreddits(subreddits, multireddit_size) if multireddit_size else subreddits
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, MAX_CONCURRENCY))
     last_comment_update = time.time()
     while True:
-        for subreddit in subreddits:
-            logger.info(f"Fetching new posts from subreddit: {subreddit}")
-            posts_data = fetch_with_backoff(reddit_client.fetch_subreddit_posts, subreddit, limit=limit)
-
-            if posts_data:
-                new_last_crawled_utc = insert_reddit_posts(posts_data["data"]["children"], subreddit)
-                if new_last_crawled_utc:
-                    update_last_crawled_time(subreddit, new_last_crawled_utc)
-                for post in posts_data["data"]["children"]:
-                    post_id = post["data"]["id"]
-                    comments_data = fetch_with_backoff(reddit_client.fetch_post_comments, post_id)
-                    if comments_data:
-                        batch_insert_reddit_comments(comments_data[1]["data"]["children"], post_id, subreddit)
+        comment_fetches = {"fetched": 0, "skipped": 0, "refreshed": 0}
+        try:
+            ensure_score_history_partitions()
+        except Exception as e:
+            logger.error(f"Could not create score_history partitions: {e}")
+        # Comment fetches are queued as soon as their listing is stored
+        listing_futures = [executor.submit(crawl_listing, listing, limit) for listing in listings]
+        comment_futures = []
+        for future in as_completed(listing_futures):
+            try:
+                due, skipped = future.result()
+            except Exception as e:
+                logger.error(f"Error crawling listing: {e}")
+                continue
+            comment_fetches["skipped"] += skipped
+            comment_fetches["fetched"] += len(due)
+            comment_futures.extend(executor.submit(crawl_post_comments, post, subreddit) for post, subreddit in due)
+        for future in as_completed(comment_futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error crawling comments: {e}")
 
         if time.time() - last_comment_update > comment_update_interval:
             logger.info("Updating comments on old posts...")
-            # Add logic to update old posts
+            comment_fetches["refreshed"] = refresh_old_posts(executor=executor)
             last_comment_update = time.time()
 
+        logger.info(f"Comment fetches this cycle: {comment_fetches['fetched']} made, "
+                    f"{comment_fetches['skipped']} skipped (comment count unchanged), "
+                    f"{comment_fetches['refreshed']} old posts refreshed")
+
+        if get_spool():
+            get_spool().rotate_if_due()
+
         logger.info(f"Waiting for {delay} seconds before the next fetch cycle...")
         time.sleep(delay)
 
@@ -249,4 +803,15 @@ if __name__ == "__main__":
         "AskAnAmerican", "UnitedKingdom", "VisaConsultants",
         "PoliticalDiscussion", "AustraliaVisa", "ImmigrationDebate"
     ]
-    crawl_reddit(subreddits=subreddits_to_monitor, limit=100, delay=120, comment_update_interval=3600)
+    parser = argparse.ArgumentParser(description="Reddit crawler")
+    parser.add_argument("--multireddit-size", type=int, default=0,
+                        help="fetch listings for this many subreddits at a time via r/a+b+c/new (default: one each)")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help=f"listing and comment fetches in flight at once (at most {MAX_CONCURRENCY})")
+    args = parser.parse_args()
+    if not 1 <= args.concurrency <= MAX_CONCURRENCY:
+        parser.error(f"--concurrency must be between 1 and {MAX_CONCURRENCY}")
+
+    ensure_schema()
+    crawl_reddit(subreddits=subreddits_to_monitor, limit=100, delay=120, comment_update_interval=300,
+                 multireddit_size=args.multireddit_size or None, concurrency=args.concurrency)
@@ -0,0 +1,287 @@
+# Bulk loader for the reddit crawler's spool: COPYs sealed segments into a staging
+# table, inserts the posts and comments they hold and checkpoints each segment
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+from refresh_schedule import FIRST_REFRESH, REFRESH_CUTOFF
+from score_history import create_score_history, ensure_partitions
+from spool import CopyStream, copy_text, read_segment, sealed_segments
+
+# Logger setup
+logger = logging.getLogger("reddit_spool_loader")
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Load environment variables
+load_dotenv()
+DATABASE_URL = os.getenv("DATABASE_URL")
+SPOOL_DIR = os.getenv("SPOOL_DIR")
+
+
+def ensure_schema(conn):
+    """Create the table recording which segments have been loaded and the columns the loader fills in."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            ALTER TABLE reddit_crawler_posts
+                ADD COLUMN IF NOT EXISTS num_comments INTEGER,
+                ADD COLUMN IF NOT EXISTS comments_fetched_count INTEGER,
+                ADD COLUMN IF NOT EXISTS comments_fetched_at TIMESTAMPTZ,
+                ADD COLUMN IF NOT EXISTS next_refresh_at TIMESTAMPTZ
+        """)
+        cur.execute("""
+            ALTER TABLE reddit_crawler_comments
+                ADD COLUMN IF NOT EXISTS parent_id TEXT,
+                ADD COLUMN IF NOT EXISTS depth INTEGER,
+                ADD COLUMN IF NOT EXISTS last_checked TIMESTAMPTZ
+        """)
+        create_score_history(cur)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS reddit_spool_checkpoint (
+                segment TEXT PRIMARY KEY,
+                records INTEGER NOT NULL,
+                loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+    conn.commit()
+
+
+def staging_lines(path):
+    """COPY text-format lines (kind, subreddit, post_id, num_comments, fetched_at, data) for a segment's records."""
+    for record in read_segment(path):
+        yield "\t".join((
+            copy_text(record["kind"]),
+            copy_text(record["subreddit"]),
+            copy_text(record.get("post_id")),
+            copy_text(record.get("num_comments")),
+            copy_text(record["fetched_at"]),
+            copy_text(json.dumps(record["data"], separators=(",", ":")))
+        )) + "\n"
+
+
+def merge_staged_records(cur):
+    """
+    Upsert the staged posts and comments, append score changes to score_history and move
+    the crawl watermarks forward. Only the latest fetch of each post or comment counts, and
+    it never overwrites a newer one, so reloading old segments cannot roll scores back.
+    """
+    cur.execute("SELECT DISTINCT to_timestamp(fetched_at) FROM reddit_spool_staging")
+    ensure_partitions(cur, [fetched_at for fetched_at, in cur.fetchall()])
+
+    # Posts from listings; every CTE sees the tables as they were before the statement
+    cur.execute("""
+        WITH incoming AS (
+            SELECT DISTINCT ON (p.data->>'id')
+               p.data->>'id' AS post_id,
+               COALESCE(p.data->>'title', '[No Title]'),
+               COALESCE(p.data->>'author', '[Unknown]'),
+               to_timestamp((p.data->>'created_utc')::double precision),
+               COALESCE(p.data->>'selftext', ''),
+               COALESCE((p.data->>'score')::integer, 0) AS score,
+               (p.data->>'num_comments')::integer AS num_comments,
+               s.subreddit,
+               to_timestamp(s.fetched_at) AS last_checked,
+               CASE WHEN s.fetched_at - (p.data->>'created_utc')::double precision < %s
+                    THEN to_timestamp((p.data->>'created_utc')::double precision) + %s
+               END
+            FROM reddit_spool_staging s
+            CROSS JOIN LATERAL jsonb_array_elements(s.data->'data'->'children') AS child(post)
+            CROSS JOIN LATERAL (SELECT child.post->'data' AS data) p
+            -- Backfilled pages store posts but leave the live crawl watermark alone
+            WHERE s.kind IN ('listing', 'backfill')
+            ORDER BY p.data->>'id', s.fetched_at DESC
+        ), previous AS (
+            SELECT p.post_id, p.score, p.num_comments
+            FROM reddit_crawler_posts p
+            JOIN incoming i ON i.post_id = p.post_id
+        ), upserted AS (
+            INSERT INTO reddit_crawler_posts (
+                post_id, title, author, created_utc, content, score, num_comments, subreddit, last_checked,
+                next_refresh_at
+            )
+            SELECT * FROM incoming
+            ON CONFLICT (post_id) DO UPDATE
+            SET score = EXCLUDED.score, num_comments = EXCLUDED.num_comments, last_checked = EXCLUDED.last_checked
+            WHERE reddit_crawler_posts.last_checked IS NULL
+               OR reddit_crawler_posts.last_checked < EXCLUDED.last_checked
+            RETURNING post_id, score, num_comments, last_checked
+        ), history AS (
+            INSERT INTO score_history (fullname, score, num_comments, observed_at)
+            SELECT 't3_' || u.post_id, u.score, u.num_comments, u.last_checked
+            FROM upserted u
+            LEFT JOIN previous pr ON pr.post_id = u.post_id
+            WHERE pr.post_id IS NULL OR (pr.score, pr.num_comments) IS DISTINCT FROM (u.score, u.num_comments)
+        )
+        SELECT COUNT(*) FROM upserted
+    """, (REFRESH_CUTOFF.total_seconds(), FIRST_REFRESH))
+    posts = cur.fetchone()[0]
+
+    # Placeholders for comments whose post was never stored
+    cur.execute("""
+        INSERT INTO reddit_crawler_posts (post_id, title, author, created_utc, content, score, subreddit, last_checked)
+        SELECT DISTINCT ON (s.post_id) s.post_id, '[Placeholder Title]', '[Unknown]', now(), '', 0, s.subreddit, now()
+        FROM reddit_spool_staging s
+        WHERE s.kind = 'comments'
+        ON CONFLICT (post_id) DO NOTHING
+    """)
+
+    # Comments are spooled as the crawler's flattened tree; anything without created_utc is skipped like there
+    cur.execute("""
+        WITH incoming AS (
+            SELECT DISTINCT ON (c.data->>'id')
+               c.data->>'id' AS comment_id,
+               s.post_id,
+               COALESCE(c.data->>'author', '[Unknown]'),
+               to_timestamp((c.data->>'created_utc')::double precision),
+               c.data->>'body',
+               (c.data->>'score')::integer AS score,
+               c.data->>'parent_id',
+               (c.data->>'depth')::integer,
+               to_timestamp(s.fetched_at) AS last_checked
+            FROM reddit_spool_staging s
+            CROSS JOIN LATERAL jsonb_array_elements(s.data) AS child(comment)
+            CROSS JOIN LATERAL (SELECT child.comment->'data' AS data) c
+            WHERE s.kind = 'comments' AND c.data ? 'created_utc'
+            ORDER BY c.data->>'id', s.fetched_at DESC
+        ), previous AS (
+            SELECT c.comment_id, c.score
+            FROM reddit_crawler_comments c
+            JOIN incoming i ON i.comment_id = c.comment_id
+        ), upserted AS (
+            INSERT INTO reddit_crawler_comments (
+                comment_id, post_id, author, created_utc, content, score, parent_id, depth, last_checked
+            )
+            SELECT * FROM incoming
+            ON CONFLICT (comment_id) DO UPDATE
+            SET score = EXCLUDED.score, last_checked = EXCLUDED.last_checked
+            WHERE reddit_crawler_comments.last_checked IS NULL
+               OR reddit_crawler_comments.last_checked < EXCLUDED.last_checked
+            RETURNING comment_id, score, last_checked, (xmax = 0) AS inserted
+        ), history AS (
+            INSERT INTO score_history (fullname, score, observed_at)
+            SELECT 't1_' || u.comment_id, u.score, u.last_checked
+            FROM upserted u
+            LEFT JOIN previous pr ON pr.comment_id = u.comment_id
+            WHERE pr.comment_id IS NULL OR pr.score IS DISTINCT FROM u.score
+        )
+        SELECT COUNT(*) FROM upserted WHERE inserted
+    """)
+    comments = cur.fetchone()[0]
+
+    # Comment watermarks, from the latest fetch of each post in the segment
+    cur.execute("""
+        UPDATE reddit_crawler_posts p
+        SET comments_fetched_count = latest.num_comments,
+            comments_fetched_at = to_timestamp(latest.fetched_at)
+        FROM (
+            SELECT DISTINCT ON (post_id) post_id, num_comments, fetched_at
+            FROM reddit_spool_staging
+            WHERE kind = 'comments'
+            ORDER BY post_id, fetched_at DESC
+        ) latest
+        WHERE p.post_id = latest.post_id
+    """)
+
+    cur.execute("""
+        INSERT INTO reddit_crawling_state (subreddit, last_crawled_utc)
+        SELECT s.subreddit, MAX(to_timestamp((child.post->'data'->>'created_utc')::double precision))
+        FROM reddit_spool_staging s
+        CROSS JOIN LATERAL jsonb_array_elements(s.data->'data'->'children') AS child(post)
+        WHERE s.kind = 'listing'
+        GROUP BY s.subreddit
+        ON CONFLICT (subreddit) DO UPDATE
+        SET last_crawled_utc = GREATEST(reddit_crawling_state.last_crawled_utc, EXCLUDED.last_crawled_utc)
+    """)
+    return posts, comments
+
+
+def load_segment(conn, path, reload=False):
+    """Load one sealed segment in a single transaction; returns the records loaded, or None if skipped."""
+    segment = os.path.basename(path)
+    cur = conn.cursor()
+    try:
+        if not reload:
+            cur.execute("SELECT 1 FROM reddit_spool_checkpoint WHERE segment = %s", (segment,))
+            if cur.fetchone():
+                conn.commit()
+                return None
+
+        cur.execute("""
+            CREATE TEMP TABLE reddit_spool_staging (
+                kind TEXT,
+                subreddit TEXT,
+                post_id TEXT,
+                num_comments INTEGER,
+                fetched_at DOUBLE PRECISION,
+                data JSONB
+            ) ON COMMIT DROP
+        """)
+        cur.copy_expert(
+            "COPY reddit_spool_staging (kind, subreddit, post_id, num_comments, fetched_at, data) FROM STDIN",
+            CopyStream(staging_lines(path))
+        )
+        records = cur.rowcount
+        posts, comments = merge_staged_records(cur)
+
+        # Same transaction as the inserts, so a segment is loaded exactly once
+        cur.execute("""
+            INSERT INTO reddit_spool_checkpoint (segment, records)
+            VALUES (%s, %s)
+            ON CONFLICT (segment) DO UPDATE SET records = EXCLUDED.records, loaded_at = now()
+        """, (segment, records))
+        conn.commit()
+        logger.info(f"Loaded {segment}: {records} records, {posts} posts upserted, {comments} new comments")
+        return records
+    except Exception as e:
+        logger.error(f"Error loading {segment}: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def load_spool(conn, spool_dir, reload=False, delete=False):
+    """Load every sealed segment in write order; returns the number of segments loaded."""
+    loaded = 0
+    for path in sealed_segments(spool_dir, "reddit"):
+        if load_segment(conn, path, reload) is not None:
+            loaded += 1
+        if delete:
+            os.remove(path)
+    return loaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load spooled reddit listings and comments into Postgres")
+    parser.add_argument("--spool-dir", default=SPOOL_DIR, required=not SPOOL_DIR)
+    parser.add_argument("--reload", action="store_true",
+                        help="load segments again even if already checkpointed (e.g. after a schema change)")
+    parser.add_argument("--delete", action="store_true", help="delete segments once loaded")
+    parser.add_argument("--follow", type=int, metavar="SECONDS",
+                        help="keep running, checking for new segments every SECONDS")
+    args = parser.parse_args()
+
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            ensure_schema(conn)
+            segments = load_spool(conn, args.spool_dir, args.reload, args.delete)
+            logger.info(f"Loaded {segments} segments")
+        except Exception as e:
+            logger.error(f"Loading stopped: {e}")
+        finally:
+            if conn:
+                conn.close()
+        if not args.follow:
+            break
+        time.sleep(args.follow)
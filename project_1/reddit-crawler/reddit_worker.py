@@ -0,0 +1,346 @@
+# Faktory worker for the Reddit crawler: consumes crawl-subreddit, crawl-refresh and
+# crawl-comments jobs so listings and comment refreshes can be spread over many processes
+
+import argparse
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from psycopg2.pool import ThreadedConnectionPool
+from pyfaktory import Client, Consumer, Job, Producer
+
+import reddit_crawler
+from reddit_client import PRIORITY_COMMENTS, PRIORITY_REFRESH, RedditClient, SharedRateLimitScheduler
+from reddit_crawler import (
+    DATABASE_URL,
+    MAX_CONCURRENCY,
+    crawl_listing,
+    ensure_schema,
+    ensure_score_history_partitions,
+    execute_with_retry,
+    get_connection_from_pool,
+    get_posts_due_for_refresh,
+    refresh_post,
+    refresh_post_metadata,
+    release_connection,
+    reschedule_refresh,
+)
+from refresh_schedule import next_refresh_at
+
+# Load environment variables
+load_dotenv()
+FAKTORY_SERVER_URL = os.environ.get("FAKTORY_SERVER_URL")
+# Seconds between listing crawls of the same subreddit
+LISTING_INTERVAL = int(os.environ.get("REDDIT_LISTING_INTERVAL", "120"))
+# Seconds between crawl-refresh passes over the posts due for a revisit
+REFRESH_INTERVAL = int(os.environ.get("REDDIT_REFRESH_INTERVAL", "60"))
+# Posts checked per crawl-refresh pass
+REFRESH_BATCH_SIZE = 500
+# How long a queued revisit holds its post before the post comes due again
+REVISIT_LEASE = timedelta(minutes=15)
+
+# Logger setup
+logger = logging.getLogger("reddit worker")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Process the crawler's client and pool were last set up in
+worker_pid = None
+
+
+def use_worker_process():
+    """
+    Give a job process forked by the consumer its own database connections and Reddit
+    session, and pace it with the rate limiter shared by every worker process on the
+    machine. Also makes sure score_history has this month's partitions, as a worker can
+    run for months.
+    """
+    global worker_pid
+    if worker_pid == os.getpid():
+        ensure_score_history_partitions()
+        return
+    reddit_crawler.connection_pool = ThreadedConnectionPool(1, MAX_CONCURRENCY, dsn=DATABASE_URL)
+    client = RedditClient()
+    client.rate_limiter = SharedRateLimitScheduler()
+    reddit_crawler.reddit_client = client
+    worker_pid = os.getpid()
+    ensure_score_history_partitions()
+
+
+def rotates_spool(job):
+    """
+    Seal this process's spool segment after each run of `job` once it is due. Job
+    processes outlive many jobs, so nothing else would seal a segment until the
+    worker restarts.
+    """
+    @functools.wraps(job)
+    def run(*args):
+        try:
+            return job(*args)
+        finally:
+            spool = reddit_crawler.get_spool()
+            if spool:
+                spool.rotate_if_due()
+    return run
+
+
+@contextmanager
+def advisory_lock(key):
+    """
+    Try to hold a Postgres advisory lock on `key` for the duration of the block; yields
+    whether it was taken. The lock dies with the connection, so a crashed worker never
+    leaves it behind.
+    """
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+    acquired = False
+    try:
+        cur.execute("SELECT pg_try_advisory_lock(hashtextextended(%s, 0))", (key,))
+        acquired = cur.fetchone()[0]
+        conn.commit()
+        yield acquired
+    finally:
+        if acquired:
+            cur.execute("SELECT pg_advisory_unlock(hashtextextended(%s, 0))", (key,))
+            conn.commit()
+        cur.close()
+        release_connection(conn)
+
+
+def get_refresh_state(post_id):
+    """Return (comments_fetched_count, next_refresh_at) of a stored post, or None if it is not stored"""
+    conn = get_connection_from_pool()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT comments_fetched_count, next_refresh_at
+            FROM reddit_crawler_posts
+            WHERE post_id = %s
+        """, (post_id,))
+        row = cur.fetchone()
+        conn.commit()
+        return row
+    finally:
+        cur.close()
+        release_connection(conn)
+
+
+def get_listing_schedule(subreddit):
+    """When the live crawl-subreddit chain of a subreddit is next due, or None if it has none"""
+    query = "SELECT listing_scheduled_at FROM reddit_crawling_state WHERE subreddit = %s"
+    result = execute_with_retry(query, (subreddit,))
+    return result[0][0] if result else None
+
+
+def set_listing_schedule(subreddit, scheduled_at):
+    query = """
+        INSERT INTO reddit_crawling_state (subreddit, listing_scheduled_at)
+        VALUES (%s, %s)
+        ON CONFLICT (subreddit) DO UPDATE SET listing_scheduled_at = EXCLUDED.listing_scheduled_at
+    """
+    execute_with_retry(query, (subreddit, scheduled_at))
+
+
+def get_job_schedule(jobtype):
+    """When the live chain of a worker-wide job type is next due, or None if it has none"""
+    query = "SELECT scheduled_at FROM reddit_worker_schedule WHERE jobtype = %s"
+    result = execute_with_retry(query, (jobtype,))
+    return result[0][0] if result else None
+
+
+def set_job_schedule(jobtype, scheduled_at):
+    query = """
+        INSERT INTO reddit_worker_schedule (jobtype, scheduled_at)
+        VALUES (%s, %s)
+        ON CONFLICT (jobtype) DO UPDATE SET scheduled_at = EXCLUDED.scheduled_at
+    """
+    execute_with_retry(query, (jobtype, scheduled_at))
+
+
+def comments_job(post_id, subreddit, created_utc, refresh_at=None):
+    """crawl-comments job for a post; `refresh_at` marks a revisit and is the next_refresh_at it was queued at"""
+    args = (post_id, subreddit, created_utc.isoformat(), refresh_at and refresh_at.isoformat())
+    return Job(jobtype="crawl-comments", args=args, queue="crawl-comments")
+
+
+@rotates_spool
+def crawl_comments(post_id, subreddit, created_utc, refresh_at=None):
+    """
+    Fetch and store a post's comments; storing them sets the post's next revisit on
+    its refresh tier, which crawl-refresh picks up when due. A revisit whose time no
+    longer matches the post's next_refresh_at was superseded by a newer fetch and is
+    dropped, so a post is only ever revisited once however many jobs queued it.
+    """
+    use_worker_process()
+    created_utc = datetime.fromisoformat(created_utc)
+    refresh_at = refresh_at and datetime.fromisoformat(refresh_at)
+    with advisory_lock(f"reddit_post/{post_id}") as acquired:
+        if not acquired:
+            logger.info(f"Comments of post {post_id} are being crawled by another worker, skipping")
+            return
+
+        state = get_refresh_state(post_id)
+        fetched_count, scheduled_at = state if state else (None, None)
+        if refresh_at and scheduled_at != refresh_at:
+            logger.info(f"Revisit of post {post_id} at {refresh_at} was superseded, skipping")
+            return
+
+        # Listings and crawl-refresh only queue posts whose count moved, so there is no count to compare here
+        priority = PRIORITY_REFRESH if refresh_at else PRIORITY_COMMENTS
+        result = refresh_post(post_id, subreddit, created_utc, fetched_count, None, priority)
+        if result is None:
+            raise RuntimeError(f"Could not crawl comments of post {post_id}")
+
+
+@rotates_spool
+def crawl_refresh(batch_size=REFRESH_BATCH_SIZE, scheduled_at=None):
+    """
+    Check the comment counts of the posts due for a revisit through /api/info, 100 per
+    request, and queue a crawl-comments job for each whose count moved; unchanged posts
+    are only rescheduled. A queued revisit moves its post's next_refresh_at out by
+    REVISIT_LEASE, so later passes don't queue it again and a lost job is retried once
+    the lease runs out. Re-enqueues itself, at once while posts are backlogged; the
+    chain is recorded in reddit_worker_schedule like crawl-subreddit's.
+    """
+    use_worker_process()
+    scheduled_at = scheduled_at and datetime.fromisoformat(scheduled_at)
+    with advisory_lock("reddit_refresh") as acquired:
+        if not acquired:
+            logger.info("Revisits are being checked by another worker, skipping")
+            return
+        if scheduled_at and get_job_schedule("crawl-refresh") != scheduled_at:
+            logger.info(f"Refresh pass at {scheduled_at} was superseded, skipping")
+            return
+
+        due = get_posts_due_for_refresh(batch_size)
+        current_counts = refresh_post_metadata(post_id for post_id, _, _, _ in due)
+        lease = datetime.now(timezone.utc) + REVISIT_LEASE
+        jobs = []
+        for post_id, subreddit, created_utc, fetched_count in due:
+            created_utc = created_utc.replace(tzinfo=created_utc.tzinfo or timezone.utc)
+            current_count = current_counts.get(post_id)
+            if current_count is not None and current_count == fetched_count:
+                reschedule_refresh(post_id, next_refresh_at(created_utc, active=False))
+            else:
+                reschedule_refresh(post_id, lease)
+                jobs.append(comments_job(post_id, subreddit, created_utc, lease))
+
+        backlogged = len(due) == batch_size
+        run_at = datetime.now(timezone.utc) + timedelta(seconds=0 if backlogged else REFRESH_INTERVAL)
+        with Client(faktory_url=FAKTORY_SERVER_URL, role="producer") as client:
+            producer = Producer(client=client)
+            if jobs:
+                producer.push_bulk(jobs)
+            producer.push(Job(
+                jobtype="crawl-refresh",
+                args=(batch_size, run_at.isoformat()),
+                queue="crawl-refresh",
+                at=run_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+            ))
+        # Recorded after the push: if this fails, the retried job still matches the old schedule
+        set_job_schedule("crawl-refresh", run_at)
+        if due:
+            logger.info(f"Queued comment revisits of {len(jobs)} of {len(due)} posts due, "
+                        f"{len(due) - len(jobs)} unchanged")
+
+
+@rotates_spool
+def crawl_subreddit(subreddit, limit=100, scheduled_at=None):
+    """
+    Store a subreddit's new posts, enqueue comment crawls for them and schedule the next
+    listing crawl. The next run is recorded in reddit_crawling_state; a scheduled job
+    that no longer matches it was superseded and is dropped. A job without
+    `scheduled_at` (a seed or cold start) always runs and takes the chain over, so
+    seeding a subreddit twice never leaves it with two chains.
+    """
+    use_worker_process()
+    logger.info(f"Starting listing crawl for subreddit: {subreddit}")
+    scheduled_at = scheduled_at and datetime.fromisoformat(scheduled_at)
+    with advisory_lock(f"reddit_listing/{subreddit}") as acquired:
+        if not acquired:
+            # Another worker is crawling this listing and will schedule the next crawl
+            logger.info(f"r/{subreddit} is being crawled by another worker, skipping")
+            return
+        if scheduled_at and get_listing_schedule(subreddit) != scheduled_at:
+            logger.info(f"Listing crawl of r/{subreddit} at {scheduled_at} was superseded, skipping")
+            return
+
+        due, skipped = crawl_listing(subreddit, limit)
+        jobs = [
+            comments_job(post["data"]["id"], post_subreddit,
+                         datetime.fromtimestamp(post["data"]["created_utc"], tz=timezone.utc))
+            for post, post_subreddit in due
+        ]
+
+        run_at = datetime.now(timezone.utc) + timedelta(seconds=LISTING_INTERVAL)
+        with Client(faktory_url=FAKTORY_SERVER_URL, role="producer") as client:
+            producer = Producer(client=client)
+            if jobs:
+                logger.info(f"Enqueuing {len(jobs)} comment jobs for r/{subreddit}, {skipped} unchanged")
+                producer.push_bulk(jobs)
+            producer.push(Job(
+                jobtype="crawl-subreddit",
+                args=(subreddit, limit, run_at.isoformat()),
+                queue="crawl-subreddit",
+                at=run_at.strftime("%Y-%m-%dT%H:%M:%SZ")
+            ))
+        # Recorded after the push: if this fails, the retried job still matches the old schedule
+        set_listing_schedule(subreddit, run_at)
+        logger.info(f"Scheduled next listing crawl for r/{subreddit} at {run_at}")
+
+
+def enqueue_subreddits(subreddits, limit=100):
+    """Push an initial crawl-subreddit job for each subreddit"""
+    with Client(faktory_url=FAKTORY_SERVER_URL, role="producer") as client:
+        producer = Producer(client=client)
+        for subreddit in subreddits:
+            producer.push(Job(jobtype="crawl-subreddit", args=(subreddit, limit), queue="crawl-subreddit"))
+            logger.info(f"Enqueued listing crawl for r/{subreddit}")
+
+
+def enqueue_refresh():
+    """Push a crawl-refresh job, taking over the revisit chain"""
+    with Client(faktory_url=FAKTORY_SERVER_URL, role="producer") as client:
+        Producer(client=client).push(Job(jobtype="crawl-refresh", queue="crawl-refresh"))
+    logger.info("Enqueued revisit check")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Faktory worker for the Reddit crawler")
+    parser.add_argument("--concurrency", type=int, default=5, help="jobs run at the same time")
+    parser.add_argument("--seed", nargs="*", metavar="SUBREDDIT",
+                        help="enqueue a listing crawl for each subreddit, plus the revisit check of stored posts")
+    args = parser.parse_args()
+
+    ensure_schema()
+
+    if args.seed is not None:
+        enqueue_subreddits(reddit_crawler.dedupe_subreddits(args.seed))
+        enqueue_refresh()
+
+    # Job processes open their own connections; the forked copies of these must not be used
+    reddit_crawler.connection_pool.closeall()
+
+    # Listings first so new posts are never starved by a backlog of comment jobs
+    queues = ["crawl-subreddit", "crawl-refresh", "crawl-comments"]
+    logger.info(f"Starting worker on queues: {queues}")
+
+    while True:
+        try:
+            with Client(faktory_url=FAKTORY_SERVER_URL, role="consumer") as client:
+                consumer = Consumer(client=client, queues=queues, priority="strict", concurrency=args.concurrency)
+                consumer.register("crawl-subreddit", crawl_subreddit)
+                consumer.register("crawl-refresh", crawl_refresh)
+                consumer.register("crawl-comments", crawl_comments)
+                consumer.run()
+        except Exception as e:
+            logger.error(f"An error occurred: {e}")
+            time.sleep(30)
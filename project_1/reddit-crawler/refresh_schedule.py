@@ -0,0 +1,31 @@
+# Age-tiered schedule for revisiting the comments of posts already crawled
+
+from datetime import datetime, timedelta, timezone
+
+# (post age up to, revisit interval), youngest first
+REFRESH_TIERS = [
+    (timedelta(hours=1), timedelta(minutes=5)),
+    (timedelta(days=1), timedelta(hours=1)),
+    (timedelta(days=7), timedelta(days=1)),
+]
+# Posts older than this are no longer revisited
+REFRESH_CUTOFF = REFRESH_TIERS[-1][0]
+# Interval before a newly stored post is first revisited
+FIRST_REFRESH = REFRESH_TIERS[0][1]
+
+
+def next_refresh_at(created_utc, active=True, now=None):
+    """
+    When a post's comments should next be fetched, or None once it is past the
+    cutoff. A post whose last fetch found no new comments is scheduled on the
+    next tier's interval, so quiet threads decay faster than their age alone says.
+    """
+    now = now or datetime.now(timezone.utc)
+    age = now - created_utc
+    for tier, (max_age, interval) in enumerate(REFRESH_TIERS):
+        if age < max_age:
+            if not active:
+                interval = REFRESH_TIERS[min(tier + 1, len(REFRESH_TIERS) - 1)][1]
+            due = now + interval
+            return due if due - created_utc <= REFRESH_CUTOFF else None
+    return None
@@ -0,0 +1,39 @@
+# Append-only history of post and comment scores, partitioned by month
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month):
+    return month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+
+
+def create_score_history(cur):
+    """
+    Create score_history: one row per observed change of a post's score/num_comments
+    (fullname t3_<id>) or a comment's score (t1_<id>), plus the first observation.
+    Old months can be dropped or archived a partition at a time.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS score_history (
+            fullname TEXT NOT NULL,
+            score INTEGER,
+            num_comments INTEGER,
+            observed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        ) PARTITION BY RANGE (observed_at)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS score_history_fullname_idx
+        ON score_history (fullname, observed_at)
+    """)
+
+
+def ensure_partitions(cur, moments):
+    """Create the monthly partitions that rows observed at `moments` (aware datetimes) go in."""
+    for month in sorted({month_start(moment) for moment in moments}):
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS score_history_{month:%Y_%m}
+            PARTITION OF score_history
+            FOR VALUES FROM (%s) TO (%s)
+        """, (month, next_month(month)))
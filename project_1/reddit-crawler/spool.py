@@ -0,0 +1,147 @@
+# Write-ahead spool: crawled payloads go to rotating, gzip-compressed, append-only
+# segment files that a separate loader bulk-ingests into Postgres
+
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+
+OPEN_SUFFIX = ".jsonl.gz.open"
+SEALED_SUFFIX = ".jsonl.gz"
+
+
+class Spool:
+    """
+    Appends JSON records, one per line, to the current segment of `directory`.
+    The segment being written ends in .open; it is sealed (renamed) once it holds
+    `max_segment_bytes` of uncompressed data or is `max_segment_age` seconds old,
+    and only sealed segments are picked up by the loader. Every append is flushed
+    to a gzip sync point, so a crash loses at most the record being written.
+    """
+
+    def __init__(self, directory, prefix, max_segment_bytes=64 * 1024 * 1024, max_segment_age=300):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.lock = threading.Lock()
+        self.file = None
+        self.path = None
+        self.opened_at = None
+        self.written = 0
+        self.sequence = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # Segments left open by a crashed writer are readable up to their last sync point
+        for path in glob.glob(os.path.join(directory, f"{prefix}-*{OPEN_SUFFIX}")):
+            if not writer_alive(path):
+                os.rename(path, path[:-len(".open")])
+
+    def append(self, record):
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self.lock:
+            if self.segment_due():
+                self.seal()
+            if self.file is None:
+                self.open_segment()
+            self.file.write(line)
+            self.file.flush(zlib.Z_SYNC_FLUSH)
+            self.written += len(line)
+
+    def rotate_if_due(self):
+        """Seal the current segment if it is full or old; call periodically so quiet crawls still get loaded"""
+        with self.lock:
+            if self.segment_due():
+                self.seal()
+
+    def segment_due(self):
+        return self.file is not None and (
+            self.written >= self.max_segment_bytes
+            or time.monotonic() - self.opened_at >= self.max_segment_age
+        )
+
+    def open_segment(self):
+        self.sequence += 1
+        # Names sort in write order, which is the order the loader ingests them
+        name = f"{self.prefix}-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{os.getpid()}-{self.sequence:06d}"
+        self.path = os.path.join(self.directory, name + OPEN_SUFFIX)
+        self.file = gzip.open(self.path, "ab")
+        self.opened_at = time.monotonic()
+        self.written = 0
+
+    def seal(self):
+        """Close the current segment and make it visible to the loader"""
+        if self.file is None:
+            return
+        self.file.close()
+        os.rename(self.path, self.path[:-len(".open")])
+        self.file = None
+        self.path = None
+
+    def close(self):
+        with self.lock:
+            self.seal()
+
+
+def writer_alive(path):
+    """Whether the process that opened a segment (pid is in its name) is still running"""
+    try:
+        pid = int(os.path.basename(path).split("-")[-2])
+        if pid == os.getpid():
+            return False
+        os.kill(pid, 0)
+    except (ValueError, IndexError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def sealed_segments(directory, prefix):
+    """Sealed segment paths in write order"""
+    return sorted(glob.glob(os.path.join(directory, f"{prefix}-*{SEALED_SUFFIX}")))
+
+
+def read_segment(path):
+    """Yield the records of a segment, stopping quietly at a torn tail left by a crash"""
+    with gzip.open(path, "rb") as segment:
+        while True:
+            try:
+                line = segment.readline()
+            except (EOFError, zlib.error):
+                return
+            if not line:
+                return
+            if not line.endswith(b"\n"):
+                # Partially written last record
+                return
+            yield json.loads(line)
+
+
+class CopyStream:
+    """File-like object that feeds `copy_expert(... FROM STDIN ...)` from an iterator of text lines"""
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def copy_text(value):
+    """Escape a value for COPY's text format"""
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")